@@ -0,0 +1,135 @@
+from time import perf_counter
+
+import numpy
+
+import pendulum
+
+# High-precision solution that other tolerances are checked against
+REFERENCE = ('DOP853', 1e-10, 1e-12)
+# Candidates from the loosest, atol is rtol * ATOL_RATIO like the defaults
+RTOLS = (1e-1, 3e-2, 1e-2, 3e-3, 1e-3, 3e-4, 1e-4, 3e-5, 1e-5, 1e-6, 1e-7,
+         1e-8, 1e-9)
+ATOL_RATIO = 1e-3
+SUBSTEPS = (1, 2, 4, 8, 16)
+
+
+def pixel_errors(results, reference):
+    """
+    Screen-space distance between two solutions.
+
+    Positions are in pixels, so this is how far apart the drawn pendulums
+    are.
+
+    Parameters:
+        results (list): Positions of each pendulum, shape (flame, n, 2).
+        reference (list): The same for the reference solution.
+
+    Returns:
+        array: Distance of the farthest joint of each pendulum at each
+            frame, shape (len(results), flame). Frames missing from a
+            result (the integrator gave up) are inf.
+    """
+    errors = numpy.full((len(reference), len(reference[0])), numpy.inf)
+    for error, result, ref in zip(errors, results, reference):
+        result = numpy.asarray(result)
+        distance = numpy.linalg.norm(result - ref[:len(result)], axis=-1)
+        error[:len(result)] = distance.max(axis=-1)
+    return errors
+
+
+def frames_within(errors, max_error):
+    """
+    Returns:
+        array: Number of frames of each pendulum before the error first
+            exceeds max_error.
+    """
+    over = errors > max_error
+    return numpy.where(over.any(axis=1), over.argmax(axis=1),
+                       errors.shape[1])
+
+
+def run(batch, flame, method, setting):
+    start = perf_counter()
+    if method in pendulum.FIXED_STEP_METHODS:
+        ys = pendulum.integrate(batch.eom, batch.time, batch.initial_state(),
+                                flame, method, substeps=setting)
+    else:
+        ys = batch.integrate(flame, method, setting, setting * ATOL_RATIO)
+    return batch.split(ys), perf_counter() - start
+
+
+def tune(batch, flame, max_error=0.5, method='RK45', horizon=None):
+    """
+    Solve with the loosest tolerance that stays within max_error pixels of
+    a high-precision reference.
+
+    The pendulums are chaotic, so any two solutions drift apart in the end,
+    including the reference and a 100 times tighter one. By default the
+    error is only measured over the frames where those two still agree
+    within max_error.
+
+    Parameters:
+        batch (BatchPendulumSolver): Pendulums to solve.
+        flame (int): Number of time points to evaluate.
+        max_error (float): Allowed distance in pixels.
+        method (str): Integrator. For 'RK4' the number of steps per frame
+            is tuned instead of rtol.
+        horizon (int): Number of frames to check.
+
+    Returns:
+        tuple: (results, report). results are the positions of each
+            pendulum as returned by BatchPendulumSolver.solve. report is a
+            dict with the chosen "rtol" and "atol" or "substeps", the
+            maximum "error" in pixels within "horizon" frames, "seconds"
+            of the solve, "speedup" over the default settings and whether
+            max_error was "met". If no candidate meets it, the most
+            accurate one is returned.
+    """
+    name, rtol, atol = REFERENCE
+    reference = batch.split(batch.integrate(flame, name, rtol, atol))
+    if horizon is None:
+        check = batch.split(batch.integrate(flame, name, rtol / 100,
+                                            atol / 100))
+        horizon = int(frames_within(pixel_errors(check, reference),
+                                    max_error).min())
+    horizon = max(horizon, 1)
+
+    if method in pendulum.FIXED_STEP_METHODS:
+        key, settings, default = "substeps", SUBSTEPS, pendulum.RK4_SUBSTEPS
+    else:
+        key, settings, default = "rtol", RTOLS, 1e-3
+    _, default_seconds = run(batch, flame, method, default)
+
+    for setting in settings:
+        try:
+            results, seconds = run(batch, flame, method, setting)
+        except pendulum.IntegrationError as e:
+            # A tolerance the integrator gives up at is as bad as it gets
+            results = batch.split(e.ys)
+            seconds = numpy.inf
+        error = float(pixel_errors(results, reference)[:, :horizon].max())
+        if error <= max_error:
+            break
+    report = {key: setting, "error": error, "horizon": horizon,
+              "seconds": seconds, "speedup": default_seconds / seconds,
+              "met": error <= max_error}
+    if key == "rtol":
+        report["atol"] = setting * ATOL_RATIO
+    return results, report
+
+
+if __name__ == "__main__":
+    rng = numpy.random.default_rng(0)
+    solvers = [pendulum.PendulumSolver(
+        rng.uniform(5, 30, n), rng.uniform(1, 10, n), 30,
+        rng.uniform(-3.14, 3.14, n), rng.uniform(-1, 1, n))
+        for n in (2, 3, 4)]
+    batch = pendulum.BatchPendulumSolver(solvers)
+    for method in ('RK45', 'RK4'):
+        results, report = tune(batch, 600, 0.5, method)
+        assert len(results) == len(solvers)
+        # The chosen solution is as close as reported
+        reference = batch.split(batch.integrate(600, *REFERENCE))
+        error = pixel_errors(results, reference)[:, :report["horizon"]].max()
+        assert numpy.isclose(error, report["error"])
+        print(method, report)
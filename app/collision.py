@@ -0,0 +1,112 @@
+import numpy
+
+
+def bounding_boxes(joints, radius):
+    """
+    Per-frame bounding boxes of a pendulum.
+
+    Parameters:
+        joints (array): Joint positions, shape (frames, m, 2).
+        radius (int): Radius of the circle drawn at each joint.
+
+    Returns:
+        array: (x0, y0, x1, y1) of each frame, shape (frames, 4).
+    """
+    return numpy.concatenate([joints.min(axis=1) - radius,
+                              joints.max(axis=1) + radius], axis=1)
+
+
+def circle_hits_points(x, y, r, points):
+    """
+    Whether a circle contains any of the points, shape (k, 2).
+    """
+    d = points - (x, y)
+    return bool(((d**2).sum(axis=-1) < r**2).any())
+
+
+def circle_hits_linkages(x, y, r, boxes, joints, radius):
+    """
+    Whether a circle touches any joint circle or rod of several pendulums.
+
+    Pendulums whose bounding box the circle misses are skipped, and the
+    rest are checked together.
+
+    Parameters:
+        x, y (int): Center of the circle.
+        r (int): Radius of the circle.
+        boxes (array): (x0, y0, x1, y1) of each pendulum, shape (k, 4).
+        joints (array): Joint positions of each pendulum, shape (k, m, 2).
+            Shorter pendulums can be padded by repeating their tip.
+        radius (int): Radius of the circle drawn at each joint.
+
+    Returns:
+        bool: True if they touch.
+    """
+    near = (boxes[:, 0] < x + r) & (x - r < boxes[:, 2]) & \
+        (boxes[:, 1] < y + r) & (y - r < boxes[:, 3])
+    if not near.any():
+        return False
+    joints = joints[near]
+    c = numpy.array([x, y], dtype=float)
+    if (((joints - c)**2).sum(axis=-1) < (r + radius)**2).any():
+        return True
+
+    # Closest point of each rod to the center of the circle
+    a = joints[:, :-1].astype(float)
+    ab = joints[:, 1:] - a
+    length2 = (ab**2).sum(axis=-1)
+    t = numpy.clip(((c - a) * ab).sum(axis=-1) / numpy.maximum(length2, 1),
+                   0, 1)
+    closest = a + t[..., None] * ab
+    return bool((((closest - c)**2).sum(axis=-1) < r**2).any())
+
+
+if __name__ == "__main__":
+    # The batched test agrees with checking every joint and rod of every
+    # pendulum one by one, without bounding boxes or padding
+    import math
+
+    def brute_force(x, y, r, pendulums, radius):
+        for joints in pendulums:
+            for jx, jy in joints:
+                if math.hypot(jx - x, jy - y) < r + radius:
+                    return True
+            for (ax, ay), (bx, by) in zip(joints[:-1], joints[1:]):
+                dx, dy = bx - ax, by - ay
+                length2 = dx * dx + dy * dy
+                t = 0.0
+                if length2:
+                    t = min(1.0, max(0.0, ((x - ax) * dx + (y - ay) * dy) /
+                                     length2))
+                if math.hypot(ax + t * dx - x, ay + t * dy - y) < r:
+                    return True
+        return False
+
+    rng = numpy.random.default_rng(0)
+    radius = 5
+    hits = 0
+    for _ in range(5000):
+        count = int(rng.integers(1, 49))
+        links = rng.integers(2, 6, count)
+        joints = numpy.empty((count, links.max() + 1, 2), dtype=numpy.int32)
+        pendulums = []
+        for i, n in enumerate(links):
+            steps = rng.integers(-30, 31, (n, 2))
+            chain = numpy.cumsum(numpy.vstack([rng.integers(0, 161, 2),
+                                               steps]), axis=0)
+            pendulums.append(chain.tolist())
+            joints[i, :n + 1] = chain
+            # Padding repeats the tip, as in main.PendulumGroup
+            joints[i, n + 1:] = chain[-1]
+        boxes = numpy.concatenate([bounding_boxes(j[None], radius)
+                                   for j in joints])
+        x, y = (int(v) for v in rng.integers(0, 161, 2))
+        r = int(rng.integers(1, 9))
+        expected = brute_force(x, y, r, pendulums, radius)
+        assert circle_hits_linkages(x, y, r, boxes, joints, radius) == \
+            expected, (x, y, r, pendulums)
+        hits += expected
+        tips = joints[:, -1]
+        assert circle_hits_points(x, y, r + radius, tips) == any(
+            math.hypot(tx - x, ty - y) < r + radius for tx, ty in tips)
+    print(f"ok, {hits} of 5000 circles hit")
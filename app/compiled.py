@@ -0,0 +1,175 @@
+import math
+import os
+import sys
+
+import numpy
+
+# Numba is optional and only used with THROUGHNPENDULUM_NUMBA=1, as the
+# compiled kernels give slightly different trajectories. Otherwise, and
+# always in the web build, pendulum keeps its NumPy equations of motion.
+try:
+    if sys.platform == "emscripten" or \
+            os.environ.get("THROUGHNPENDULUM_NUMBA") != "1":
+        raise ImportError
+    import numba
+except ImportError:
+    numba = None
+
+ENABLED = numba is not None
+
+
+def jit(function):
+    """
+    Compile function with Numba if it is available.
+
+    Compiled code is cached in __pycache__, so only the first run after a
+    change pays for compilation. Without Numba the function is returned as
+    it is, which is slow but still correct.
+    """
+    if numba is None:
+        return function
+    return numba.njit(cache=True, nogil=True)(function)
+
+
+@jit
+def chain(y, lengths, inverse_weights, dy, upper, tension):
+    """
+    Linear-time equations of motion of one pendulum, see
+    PendulumSolver.eom_chain.
+
+    Parameters:
+        y (array): State vector of the pendulum, shape (2 * n,).
+        lengths (array): Length of each link, at least n long.
+        inverse_weights (array): 1 / weight of each link, at least n long.
+        dy (array): Output, shape (2 * n,).
+        upper (array): Work array of at least n elements.
+        tension (array): Work array of at least n elements.
+    """
+    g = 9.81
+    n = len(y) // 2
+
+    above = lower = 0.0
+    for k in range(n):
+        diagonal = inverse_weights[k] - lower * above
+        if k > 0:
+            diagonal += inverse_weights[k - 1]
+        off = 0.0
+        if k < n - 1:
+            off = -math.cos(y[k + 1] - y[k]) * inverse_weights[k]
+        r = lengths[k] * y[n + k] * y[n + k]
+        if k == 0:
+            r += g * math.cos(y[0])
+        else:
+            r -= lower * tension[k - 1]
+        above = off / diagonal
+        upper[k] = above
+        tension[k] = r / diagonal
+        lower = off
+    for k in range(n - 2, -1, -1):
+        tension[k] -= upper[k] * tension[k + 1]
+
+    for k in range(n):
+        dy[k] = y[n + k]
+        dy[n + k] = 0.0
+    for k in range(n - 1):
+        s = math.sin(y[k + 1] - y[k])
+        dy[n + k] += tension[k + 1] * s * inverse_weights[k]
+        dy[n + k + 1] -= tension[k] * s * inverse_weights[k]
+    dy[n] -= g * math.sin(y[0])
+    for k in range(n):
+        dy[n + k] /= lengths[k]
+
+
+@jit
+def eom(y, lengths, inverse_weights):
+    n = len(y) // 2
+    dy = numpy.empty(2 * n)
+    chain(y, lengths, inverse_weights, dy, numpy.empty(n), numpy.empty(n))
+    return dy
+
+
+@jit
+def batch_eom(y, offsets, lengths, inverse_weights):
+    """
+    Equations of motion of stacked pendulums, see BatchPendulumSolver.eom.
+
+    Parameters:
+        y (array): Stacked state vectors of all pendulums.
+        offsets (array): Start of each state vector in y, and len(y).
+        lengths (array): Lengths, shape (pendulums, longest chain).
+        inverse_weights (array): 1 / weights, with the shape of lengths.
+
+    Returns:
+        array: Derivatives of the stacked state vector.
+    """
+    dy = numpy.empty(len(y))
+    upper = numpy.empty(lengths.shape[1])
+    tension = numpy.empty(lengths.shape[1])
+    for i in range(len(offsets) - 1):
+        start, end = offsets[i], offsets[i + 1]
+        chain(y[start:end], lengths[i], inverse_weights[i], dy[start:end],
+              upper, tension)
+    return dy
+
+
+@jit
+def forward_kinematics(lengths, angles):
+    """
+    Positions of the links for angles of shape (frames, n), see
+    pendulum.forward_kinematics.
+    """
+    frames, n = angles.shape
+    positions = numpy.empty((frames, n, 2))
+    for f in range(frames):
+        x = y = 0.0
+        for k in range(n):
+            x += lengths[k] * math.sin(angles[f, k])
+            y -= lengths[k] * math.cos(angles[f, k])
+            positions[f, k, 0] = x
+            positions[f, k, 1] = y
+    return positions
+
+
+def warm_up():
+    """
+    Compile, or load from the cache, every kernel with the argument types
+    the solvers use, so that the first stage does not wait for it.
+    """
+    y = numpy.zeros(4)
+    lengths = numpy.ones((1, 2))
+    eom(y, lengths[0], lengths[0])
+    batch_eom(y, numpy.array([0, 4]), lengths, lengths)
+    forward_kinematics(lengths[0], lengths)
+
+
+if ENABLED:
+    warm_up()
+
+
+if __name__ == "__main__":
+    # The kernels agree with the NumPy equations of motion, compiled or not
+    import pendulum
+
+    print("numba" if ENABLED else
+          "numba is not enabled (THROUGHNPENDULUM_NUMBA=1), checking Python")
+    rng = numpy.random.default_rng(0)
+    solvers = [pendulum.PendulumSolver(
+        rng.uniform(5.0, 30.0, n), rng.uniform(1.0, 10.0, n), 10.0,
+        rng.uniform(-3.14, 3.14, n), rng.uniform(-1.0, 1.0, n))
+        for n in range(1, 8)]
+    for p in solvers:
+        y = rng.uniform(-3.14, 3.14, 2 * len(p.lenth_list))
+        assert numpy.allclose(eom(y, p.lengths, p.inverse_weights),
+                              p.eom(0, y), rtol=1e-9, atol=1e-12)
+        angles = rng.uniform(-3.14, 3.14, (5, len(p.lenth_list)))
+        assert numpy.allclose(forward_kinematics(p.lengths, angles),
+                              pendulum.forward_kinematics(p.lengths, angles))
+
+    batch = pendulum.BatchPendulumSolver(solvers)
+    y = rng.uniform(-3.14, 3.14, batch.offsets[-1])
+    assert numpy.allclose(
+        batch_eom(y, batch.offsets, batch.lengths, batch.inverse_weights),
+        numpy.concatenate([p.eom(0, y[start:end]) for p, start, end in zip(
+            solvers, batch.offsets[:-1], batch.offsets[1:])]),
+        rtol=1e-9, atol=1e-12)
+    print("ok")
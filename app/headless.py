@@ -0,0 +1,291 @@
+import importlib
+import os
+import random
+import sys
+from time import perf_counter
+
+import numpy
+
+KEYS = ("KEY_W", "KEY_A", "KEY_S", "KEY_D", "KEY_UP", "KEY_DOWN", "KEY_LEFT",
+        "KEY_RIGHT", "KEY_SPACE", "KEY_RETURN", "KEY_ESCAPE", "KEY_F1",
+        "KEY_F2", "KEY_F3")
+DRAW_FUNCTIONS = ("cls", "pset", "line", "rect", "rectb", "circ", "circb",
+                  "elli", "ellib", "tri", "trib", "fill", "text", "blt",
+                  "bltm")
+
+
+class StubImage:
+    """
+    Stand-in for pyxel.Image that ignores drawing.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+
+    def load(self, x, y, filename):
+        pass
+
+    def __getattr__(self, name):
+        if name in DRAW_FUNCTIONS or name in ("camera", "clip", "pal"):
+            return lambda *args, **kwargs: None
+        raise AttributeError(name)
+
+
+class StubPyxel:
+    """
+    Stand-in for the pyxel module without a window.
+
+    Drawing calls are only counted. Input comes from a function that
+    returns the set of held keys for a frame, and run() returns right away
+    so that the caller can step the game with update() and draw().
+    Random numbers come from pyxel when it is installed, so stages match
+    the real game, and from the random module otherwise.
+    """
+
+    def __init__(self, inputs=None):
+        try:
+            import pyxel
+            self.real = pyxel
+            for key in KEYS:
+                setattr(self, key, getattr(pyxel, key))
+        except ImportError:
+            self.real = None
+            self.generator = random.Random(0)
+            for i, key in enumerate(KEYS):
+                setattr(self, key, i)
+        self.inputs = inputs or (lambda frame: ())
+        self.Image = StubImage
+        self.colors = [0] * 16
+        self.width = 0
+        self.height = 0
+        self.frame_count = 0
+        self.held = frozenset()
+        self.previous = frozenset()
+        self.draw_calls = 0
+        self.callbacks = None
+
+    def init(self, width, height, **kwargs):
+        self.width = width
+        self.height = height
+        self.screen = StubImage(width, height)
+        self.images = [StubImage(256, 256) for _ in range(3)]
+
+    def run(self, update, draw):
+        self.callbacks = (update, draw)
+
+    def quit(self):
+        pass
+
+    def flip(self):
+        pass
+
+    def start_frame(self, frame):
+        self.frame_count = frame
+        self.previous = self.held
+        self.held = frozenset(self.inputs(frame))
+
+    def btn(self, key):
+        return key in self.held
+
+    def btnp(self, key, hold=None, repeat=None):
+        return key in self.held and key not in self.previous
+
+    def btnr(self, key):
+        return key in self.previous and key not in self.held
+
+    def rseed(self, seed):
+        if self.real:
+            self.real.rseed(seed)
+        else:
+            self.generator.seed(seed)
+
+    def rndi(self, a, b):
+        if self.real:
+            return self.real.rndi(a, b)
+        return self.generator.randint(a, b)
+
+    def rndf(self, a, b):
+        if self.real:
+            return self.real.rndf(a, b)
+        return self.generator.uniform(a, b)
+
+    def clip(self, *args):
+        pass
+
+    def pal(self, *args):
+        pass
+
+    def __getattr__(self, name):
+        if name in DRAW_FUNCTIONS:
+            return self.count_draw
+        raise AttributeError(name)
+
+    def count_draw(self, *args, **kwargs):
+        self.draw_calls += 1
+
+
+def install(inputs=None):
+    """
+    Replace pyxel with a StubPyxel and (re)import the game with it.
+
+    Returns:
+        tuple: (stub, main module)
+    """
+    stub = StubPyxel(inputs)
+    sys.modules["pyxel"] = stub
+    # Start from the title and leave the player's saved session alone
+    os.environ.setdefault("THROUGHNPENDULUM_SESSION", "")
+    for name in ("image", "profiler", "main"):
+        if name in sys.modules:
+            importlib.reload(sys.modules[name])
+    return stub, importlib.import_module("main")
+
+
+class HeadlessRunner:
+    """
+    Run the game loop as fast as possible without a window.
+
+    Parameters:
+        inputs (callable): inputs(frame) returns the keys held at frame.
+        draw (bool): Whether to call App.draw as well as App.update.
+    """
+
+    def __init__(self, inputs=None, draw=True):
+        self.pyxel, self.main = install(inputs)
+        self.draw = draw
+        self.app = self.main.App()
+        self.frame = 0
+        self.update_times = []
+        self.draw_times = []
+        self.states = {}
+
+    def step(self):
+        self.pyxel.start_frame(self.frame)
+        start = perf_counter()
+        self.app.update()
+        middle = perf_counter()
+        if self.draw:
+            self.app.draw()
+        end = perf_counter()
+        self.update_times.append(middle - start)
+        self.draw_times.append(end - middle)
+        self.states[self.app.status] = self.states.get(self.app.status, 0) + 1
+        self.frame += 1
+
+    def run(self, frames):
+        for _ in range(frames):
+            self.step()
+        return self
+
+    def report(self):
+        lines = [f"{self.frame} frames, {self.pyxel.draw_calls} draw calls"]
+        for name, times in (("update", self.update_times),
+                            ("draw", self.draw_times)):
+            ms = numpy.array(times) * 1000
+            lines.append(f"{name}: mean {ms.mean():.3f} ms, p50 "
+                         f"{numpy.percentile(ms, 50):.3f} ms, p99 "
+                         f"{numpy.percentile(ms, 99):.3f} ms, max "
+                         f"{ms.max():.3f} ms")
+        total = sum(self.update_times) + sum(self.draw_times)
+        lines.append(f"{self.frame / total:.0f} frames per second "
+                     f"({self.frame / total / 30:.0f}x real time)")
+        for state, count in self.states.items():
+            lines.append(f"{state.name}: {count} frames")
+        lines.append(self.main.Stage.CACHE.summary())
+        return "\n".join(lines)
+
+
+class RecordingCanvas:
+    """
+    Canvas that keeps the circles drawn on it, see check_after_images().
+    """
+
+    def __init__(self):
+        self.circles = []
+
+    def circ(self, x, y, r, c):
+        self.circles.append((x, y, r, c))
+
+
+def check_after_images(steps=50000, seed=0):
+    """
+    Check main.AfterImage against the list it replaced, which kept
+    (x, y, count) of every circle, drew it with a color by count and
+    counted down from COUNT to 0 before dropping it. The ring buffer drops
+    the oldest circles beyond CAPACITY, so only the newest CAPACITY
+    circles of the list are compared.
+    """
+    _, main = install()
+    after = main.AfterImage
+    levels = len(main.GRADATION) - 1
+    generator = random.Random(seed)
+    circles = []
+    for step in range(steps):
+        r = generator.random()
+        if r < 0.001:
+            after.clear()
+            circles = []
+        elif r < 0.003:
+            # More than fit, as when dozens of pendulums add circles
+            points = [(generator.randint(0, 159), generator.randint(0, 119))
+                      for _ in range(generator.randint(100, 1500))]
+            after.add_circles(points)
+            circles.extend((x, y, after.COUNT) for x, y in points)
+        else:
+            for _ in range(generator.randint(0, 5)):
+                x, y = generator.randint(0, 159), generator.randint(0, 119)
+                after.add_circle(x, y)
+                circles.append((x, y, after.COUNT))
+        circles = circles[-after.CAPACITY:]
+
+        reverse = step % 2 == 1
+        canvas = RecordingCanvas()
+        after.draw(reverse, canvas)
+        expected = []
+        for x, y, count in circles:
+            c = levels * count // after.COUNT
+            expected.append((x, y, after.SIZE, levels - c if reverse else c))
+        assert canvas.circles == expected, step
+
+        after.update()
+        circles = [(x, y, count - 1) for x, y, count in circles if count > 0]
+
+
+def random_inputs(seed, keys):
+    """
+    Inputs for soak tests: random keys held for spans of 8 frames.
+    """
+    generator = random.Random(seed)
+    spans = {}
+
+    def inputs(frame):
+        span = frame // 8
+        if span not in spans:
+            spans.clear()
+            spans[span] = {key for key in keys if generator.random() < 0.3}
+        return spans[span]
+    return inputs
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["check"]:
+        # Checks of the game's classes that don't need a window
+        check_after_images()
+        print("ok")
+        sys.exit(0)
+    if len(sys.argv) > 3:
+        print("Usage: python headless.py [frames] [seed]")
+        print("       python headless.py check")
+        sys.exit(1)
+    try:
+        frames = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+        seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    except ValueError:
+        print("Invalid input. Please provide integers for frames and seed.")
+        sys.exit(1)
+    runner = HeadlessRunner()
+    stub = runner.pyxel
+    stub.inputs = random_inputs(
+        seed, [stub.KEY_A, stub.KEY_D, stub.KEY_W, stub.KEY_SPACE])
+    print(runner.run(frames).report())
@@ -1,11 +1,17 @@
 import pyxel
 
 
+# Only the title is needed for the first frame, the others are loaded one
+# per call to load_pending() or when they are first drawn
 def load_images():
     TitleImage.load()
-    StageClearImage.load()
-    GameOverImage.load()
-    GameClearImage.load()
+
+
+def load_pending():
+    for image in (StageClearImage, GameOverImage, GameClearImage):
+        if image.image is None:
+            image.load()
+            return
 
 
 class ImageBase:
@@ -23,6 +29,8 @@ class ImageBase:
 
     @classmethod
     def draw(cls):
+        if cls.image is None:
+            cls.load()
         pyxel.blt(cls.X, cls.Y, cls.image, 0, 0, cls.W, cls.H)
 
 class TitleImage(ImageBase):
@@ -0,0 +1,50 @@
+import importlib
+import threading
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported on first use.
+
+    On first attribute access the module is imported and replaces the
+    stand-in under the same name in namespace, so later uses go straight
+    to the module.
+
+    Parameters:
+        name (str): Name of the module.
+        namespace (dict): globals() of the importing module.
+    """
+
+    def __init__(self, name, namespace):
+        self._name = name
+        self._namespace = namespace
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._name)
+        self._namespace[self._name] = module
+        return getattr(module, attr)
+
+
+def preload(names, done=None):
+    """
+    Import modules on a background thread.
+
+    Parameters:
+        names (list): Names of the modules.
+        done (callable): Called on the thread once they are imported.
+
+    Returns:
+        bool: False if threads are not available (e.g. the web build), in
+            which case the modules are imported on first use.
+    """
+    def run():
+        for name in names:
+            importlib.import_module(name)
+        if done is not None:
+            done()
+
+    try:
+        threading.Thread(target=run, daemon=True).start()
+    except RuntimeError:
+        return False
+    return True
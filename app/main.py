@@ -1,9 +1,28 @@
 import pyxel
 
+import array
+import os
+import sys
+import threading
 from enum import Enum
+from time import perf_counter
 
-import pendulum
 import image
+import lazy
+import profiler
+import session
+import stage_pack
+import trajectory_cache
+
+# Importing numpy takes most of the start-up time, so the modules that
+# need it are imported on first use or in the background by App.__init__
+NUMERICAL_MODULES = ["numpy", "collision", "pendulum", "stage_generator"]
+numpy = lazy.LazyModule("numpy", globals())
+collision = lazy.LazyModule("collision", globals())
+pendulum = lazy.LazyModule("pendulum", globals())
+stage_generator = lazy.LazyModule("stage_generator", globals())
+
+profiler.Startup.mark("import")
 
 WINDOW_W = 160
 WINDOW_H = 120
@@ -20,31 +39,74 @@ GRADATION = [0x2b335f, 0x3d4775, 0x4f5b8c, 0x616fa3,
              0x7384ba, 0x8598d1, 0x97ace8, 0xa9c1ff]
 
 
+# Gradation colors of something fading out over count frames, by age
+def fade(count):
+    return [(len(GRADATION) - 1) * (count - age) // count
+            for age in range(count + 1)]
+
+
+# Element i of the van der Corput sequence in base, which fills [0, 1) evenly
+def halton(i, base):
+    value, fraction = 0.0, 1.0
+    while i > 0:
+        fraction /= base
+        value += fraction * (i % base)
+        i //= base
+    return value
+
+
 class AfterImage:
     SIZE = 5
     COUNT = 20
-    circles = []  # [(x, y, count)]
+    # Enough for dozens of pendulums adding a circle every 4 frames
+    CAPACITY = 1024
+
+    # Ring buffer of circles. Entry i lives in slot i % CAPACITY, and its
+    # count is COUNT minus the number of updates since it was added.
+    xs = array.array("i", bytes(4 * CAPACITY))
+    ys = array.array("i", bytes(4 * CAPACITY))
+    ticks = array.array("q", bytes(8 * CAPACITY))
+    written = 0  # Index of the next entry
+    oldest = 0  # Index of the oldest entry that is still drawn
+    tick = 0
+
+    # Gradation color by age
+    COLORS = fade(COUNT)
+    REVERSE_COLORS = [len(GRADATION) - 1 - c for c in COLORS]
 
     @classmethod
     def add_circle(cls, x, y):
-        cls.circles.append((x, y, cls.COUNT))
+        i = cls.written % cls.CAPACITY
+        cls.xs[i] = x
+        cls.ys[i] = y
+        cls.ticks[i] = cls.tick
+        cls.written += 1
+        if cls.written - cls.oldest > cls.CAPACITY:
+            cls.oldest = cls.written - cls.CAPACITY
+
+    @classmethod
+    def add_circles(cls, points):
+        for x, y in points:
+            cls.add_circle(x, y)
 
     @classmethod
     def clear(cls):
-        cls.circles = []
+        cls.oldest = cls.written
 
     @classmethod
     def update(cls):
-        cls.circles = [(x, y, count - 1)
-                       for x, y, count in cls.circles if count > 0]
+        cls.tick += 1
+        while cls.oldest < cls.written and \
+                cls.tick - cls.ticks[cls.oldest % cls.CAPACITY] > cls.COUNT:
+            cls.oldest += 1
 
     @classmethod
-    def draw(cls, reverse=False):
-        for circle in cls.circles:
-            c = (len(GRADATION) - 1) * circle[2] // cls.COUNT
-            if reverse:
-                c = len(GRADATION) - 1 - c
-            pyxel.circ(circle[0], circle[1], cls.SIZE, c)
+    def draw(cls, reverse=False, canvas=pyxel):
+        colors = cls.REVERSE_COLORS if reverse else cls.COLORS
+        xs, ys, ticks, tick = cls.xs, cls.ys, cls.ticks, cls.tick
+        for j in range(cls.oldest, cls.written):
+            i = j % cls.CAPACITY
+            canvas.circ(xs[i], ys[i], cls.SIZE, colors[tick - ticks[i]])
 
 
 class Pendulum:
@@ -59,51 +121,159 @@ class Pendulum:
     # Initial velocities of the pendulum bobs in m/s
     INIT_VELOCITY_RANGE = (-1.0, 1.0)
 
-    def __init__(self, n, cx, cy, flame):
-        lengths = [pyxel.rndf(*self.LENGTH_RANGE) for _ in range(n)]
-        weights = [pyxel.rndf(*self.WEIGHT_RANGE) for _ in range(n)]
-        init_angles = [pyxel.rndf(*self.INIT_ANGLE_RANGE) for _ in range(n)]
-        init_velocities = [pyxel.rndf(*self.INIT_VELOCITY_RANGE)
+    # trajectory and boxes are views into a PendulumGroup, or allocated here
+    def __init__(self, result, cx, cy, source=None, trajectory=None,
+                 boxes=None):
+        self.result = result
+        self.center = (cx, cy)
+        # IncrementalSolver that is still appending frames to result
+        self.source = source
+        if source is not None:
+            source.advance_to(0)
+            flame = source.flame
+        else:
+            flame = len(result)
+        self.links = len(result[0])
+        # Screen pixel positions of the center and every link at each frame
+        if trajectory is None:
+            trajectory = numpy.empty((flame, self.links + 1, 2),
+                                     dtype=numpy.int32)
+        self.trajectory = trajectory
+        self.trajectory[:, 0] = self.center
+        # Bounding box of everything drawn at each frame
+        if boxes is None:
+            boxes = numpy.empty((flame, 4), dtype=numpy.int32)
+        self.boxes = boxes
+        self.horizon = 0
+        self.sync()
+
+    # Endless levels with many pendulums make the links shorter by scale
+    @classmethod
+    def random_solver(cls, n, scale=1.0):
+        lengths = [pyxel.rndf(*cls.LENGTH_RANGE) * scale for _ in range(n)]
+        weights = [pyxel.rndf(*cls.WEIGHT_RANGE) for _ in range(n)]
+        init_angles = [pyxel.rndf(*cls.INIT_ANGLE_RANGE) for _ in range(n)]
+        init_velocities = [pyxel.rndf(*cls.INIT_VELOCITY_RANGE)
                            for _ in range(n)]
-        p = pendulum.PendulumSolver(
+        return pendulum.PendulumSolver(
             lengths,
             weights,
-            self.TIME_DURATION,
+            cls.TIME_DURATION,
             init_angles,
             init_velocities
         )
-        self.result = p.solve(flame)
-        self.center = (cx, cy)
+
+    # Converts the frames of result that are not in trajectory yet
+    def sync(self):
+        if self.result is None:
+            return
+        end = len(self.result)
+        if end <= self.horizon:
+            return
+        pos = numpy.asarray(self.result[self.horizon:end], dtype=float)
+        frames = self.trajectory[self.horizon:end]
+        frames[:, 1:self.links + 1, 0] = pos[..., 0] + self.center[0]
+        frames[:, 1:self.links + 1, 1] = -pos[..., 1] + self.center[1]
+        # Joints past the tip, padding in a PendulumGroup, repeat the tip
+        frames[:, self.links + 1:] = frames[:, self.links:self.links + 1]
+        self.boxes[self.horizon:end] = collision.bounding_boxes(
+            frames, self.SIZE)
+        self.horizon = end
+        if self.horizon == len(self.trajectory):
+            self.result = None
+
+
+class PendulumGroup:
+    """
+    The pendulums of a stage, with their screen trajectories stacked into
+    one array so that each frame is updated and collided with array
+    operations on all of them, instead of a call per Pendulum. Shorter
+    pendulums are padded to the longest one by repeating their tip.
+
+    Iterating gives the Pendulum objects, which convert the frames of
+    their results into the shared arrays. A group restored from a session
+    snapshot has none and plays the arrays as they are.
+
+    Parameters:
+        trajectory (array): Screen positions of the center and the joints,
+            shape (flame, pendulums, links + 1, 2).
+        boxes (array): Bounding boxes, shape (flame, pendulums, 4).
+        links (list): Number of links of each pendulum.
+        pendulums (list): Pendulum objects writing into the arrays.
+    """
+
+    def __init__(self, trajectory, boxes, links, pendulums=()):
+        self.trajectory = trajectory
+        self.boxes = boxes
+        self.links = links
+        self.pendulums = list(pendulums)
+        self.horizon = min((p.horizon for p in self.pendulums),
+                           default=len(trajectory))
         self.update(0)
 
+    @classmethod
+    def from_results(cls, results, centers, sources):
+        for source in sources:
+            if source is not None:
+                source.advance_to(0)
+        flame = max(len(result) if source is None else source.flame
+                    for result, source in zip(results, sources))
+        links = max(len(result[0]) for result in results)
+        trajectory = numpy.empty(
+            (flame, len(results), links + 1, 2), dtype=numpy.int32)
+        boxes = numpy.empty((flame, len(results), 4), dtype=numpy.int32)
+        pendulums = [
+            Pendulum(result, cx, cy, source, trajectory[:, i], boxes[:, i])
+            for i, (result, (cx, cy), source) in enumerate(
+                zip(results, centers, sources))]
+        return cls(trajectory, boxes, [p.links for p in pendulums],
+                   pendulums)
+
+    def __len__(self):
+        return len(self.links)
+
+    def complete(self):
+        return self.horizon >= len(self.trajectory)
+
+    def __iter__(self):
+        return iter(self.pendulums)
+
+    def sync(self):
+        for p in self.pendulums:
+            p.sync()
+        self.horizon = min(p.horizon for p in self.pendulums)
+
     def update(self, i):
-        self.positions = [self.center]
-        for pos in self.result[i]:
-            x = pos[0] + self.center[0]
-            y = -pos[1] + self.center[1]
-            self.positions.append((int(x), int(y)))
-        self.tip_pos = self.positions[-1]
+        if i >= self.horizon:
+            for p in self.pendulums:
+                if p.source is not None:
+                    p.source.advance_to(i)
+            self.sync()
+        # Joints of every pendulum, shape (pendulums, links + 1, 2)
+        self.positions = self.trajectory[i]
+        self.box = self.boxes[i]
+        self.tips = self.positions[:, -1]
         if i % 4 == 0:
-            AfterImage.add_circle(*self.tip_pos)
+            AfterImage.add_circles(self.tips.tolist())
 
-    def tip_position(self):
-        return self.tip_pos
-
-    def draw(self, reverse=False):
-        c1, c2 = 0, 7
+    def draw(self, reverse=False, canvas=pyxel, stroke=7):
+        c1, c2 = 0, stroke
         if reverse:
-            c1, c2 = 7, 7
-        for s, t in zip(self.positions[:-1], self.positions[1:]):
-            pyxel.line(s[0], s[1], t[0], t[1], c2)
-        for p in self.positions[:-1]:
-            pyxel.circ(p[0], p[1], self.SIZE, c1)
-            pyxel.circb(p[0], p[1], self.SIZE, c2)
-
-    def draw_tip(self, reverse=False):
+            c1, c2 = 7, stroke
+        r = Pendulum.SIZE
+        for positions, links in zip(self.positions.tolist(), self.links):
+            for s, t in zip(positions[:links], positions[1:links + 1]):
+                canvas.line(s[0], s[1], t[0], t[1], c2)
+            for p in positions[:links]:
+                canvas.circ(p[0], p[1], r, c1)
+                canvas.circb(p[0], p[1], r, c2)
+
+    def draw_tips(self, reverse=False, canvas=pyxel):
         c = 7
         if reverse:
             c = 0
-        pyxel.circ(self.tip_pos[0], self.tip_pos[1], self.SIZE, c)
+        for x, y in self.tips.tolist():
+            canvas.circ(x, y, Pendulum.SIZE, c)
 
 
 class StartPoint:
@@ -114,8 +284,8 @@ class StartPoint:
     COLOR = 11
 
     @classmethod
-    def draw(cls):
-        pyxel.rect(cls.X, cls.Y, cls.W, cls.H, cls.COLOR)
+    def draw(cls, canvas=pyxel):
+        canvas.rect(cls.X, cls.Y, cls.W, cls.H, cls.COLOR)
 
 
 class Apple:
@@ -132,8 +302,8 @@ class Apple:
         self.y = y
         self.collected = False
 
-    def draw(self):
-        pyxel.circ(self.x, self.y, self.R, self.COLOR)
+    def draw(self, canvas=pyxel):
+        canvas.circ(self.x, self.y, self.R, self.COLOR)
 
     @classmethod
     def generate(cls):
@@ -316,12 +486,17 @@ class Character:
             return True
         return False
 
-    def collision_to_pendulum(self, x, y):
+    def collision_to_tips(self, pendulums: PendulumGroup):
         px, py = self.x + self.W // 2, self.y + self.H // 2
-        distance = ((px - x) ** 2 + (py - y) ** 2)
-        if distance < (self.W // 2 + Pendulum.SIZE) ** 2:
-            return True
-        return False
+        return collision.circle_hits_points(
+            px, py, self.W // 2 + Pendulum.SIZE, pendulums.tips)
+
+    # Checks every joint and rod of the pendulums, not only the tips
+    def collision_to_linkages(self, pendulums: PendulumGroup):
+        px, py = self.x + self.W // 2, self.y + self.H // 2
+        return collision.circle_hits_linkages(
+            px, py, self.W // 2, pendulums.box, pendulums.positions,
+            Pendulum.SIZE)
 
     def draw(self):
         dx, dy = 0, 0
@@ -352,23 +527,233 @@ class Stage:
     INCREASE_PENDULUM_STAGE = 10
     GAME_CLEAR_STAGE = 50
     PENDULUM_RANGE = (2, 5)
+    # Endless levels after GAME_CLEAR_STAGE add a pendulum every
+    # ENDLESS_INCREASE_STAGE levels. Pivots past PENDULUM_CENTERS are spread
+    # over PIVOT_AREA (x0, y0, x1, y1) by a Halton sequence.
+    ENDLESS_INCREASE_STAGE = 2
+    MAX_N_ENDLESS = 48
+    PIVOT_AREA = (8, 8, WINDOW_W - 8, FLOOR // 2)
 
     FLAME = 600
+    # The web build doesn't download scipy and uses the fixed-step solver
+    SOLVER_METHOD = 'RK4' if sys.platform == "emscripten" else 'RK45'
+    # Collide with the whole pendulum instead of only its tip
+    FULL_COLLISION = True
+    # Draw the stage once and get the reversed half from a palette swap
+    COMPOSITE = True
+    # Seconds per frame spent on integrating a stage that is being played
+    SOLVE_BUDGET = 0.01
+    CACHE = trajectory_cache.TrajectoryCache(max_bytes=64 * 1024 * 1024)
+    # Prebuilt stages, see script/build_stage_pack.py
+    PACK = stage_pack.StagePack()
+    # When set, the RNG is seeded with SEED + level before drawing a stage
+    SEED = None
+    # Prefetched stages are picked from this many random candidates, solved
+    # within CANDIDATE_BUDGET seconds
+    CANDIDATES = 8
+    CANDIDATE_BUDGET = 3.0
+    GEOMETRY = {
+        "floor": FLOOR,
+        "radius": Pendulum.SIZE,
+        "character": Character.W,
+        "start": (StartPoint.X + StartPoint.W // 2,
+                  StartPoint.Y + StartPoint.H // 2),
+        "start_r": StartPoint.W // 2,
+        "apple_r": Apple.R,
+    }
+
+    @classmethod
+    def generate(cls, level, incremental=False):
+        stage = cls.load_packed(level)
+        if stage is not None:
+            return stage
+        solvers, apples = cls.random_parameters(level)
+        if incremental:
+            return cls.build_incremental(solvers, apples)
+        return cls.build(cls.solve(solvers), apples)
+
+    # Draws everything random about a stage. Uses the pyxel RNG, so it must
+    # run on the main thread.
+    @classmethod
+    def random_parameters(cls, level):
+        return cls.random_candidates(level, 1)[0]
+
+    @classmethod
+    def random_candidates(cls, level, count):
+        if cls.SEED is not None:
+            pyxel.rseed(cls.SEED + level)
+        pendulum_num = cls.pendulum_count(level)
+        # Keep the area swept by all pendulums about that of MAX_N_PENDULUM
+        scale = min(1.0, (cls.MAX_N_PENDULUM / pendulum_num) ** 0.5)
+        candidates = []
+        for _ in range(count):
+            solvers = []
+            for i in range(pendulum_num):
+                n = pyxel.rndi(*cls.PENDULUM_RANGE)
+                solvers.append(Pendulum.random_solver(n, scale))
+            apples = [Apple.generate() for _ in range(Apple.NUM_PRE_STAGE)]
+            candidates.append((solvers, apples))
+
+        return candidates
+
+    @classmethod
+    def pendulum_count(cls, level):
+        if level <= cls.GAME_CLEAR_STAGE:
+            return min(cls.MAX_N_PENDULUM,
+                       level // cls.INCREASE_PENDULUM_STAGE + 1)
+        return min(cls.MAX_N_ENDLESS, cls.MAX_N_PENDULUM +
+                   (level - cls.GAME_CLEAR_STAGE) // cls.ENDLESS_INCREASE_STAGE)
+
+    @classmethod
+    def centers(cls, count):
+        centers = list(cls.PENDULUM_CENTERS[:count])
+        x0, y0, x1, y1 = cls.PIVOT_AREA
+        i = 0
+        while len(centers) < count:
+            i += 1
+            centers.append((x0 + int(halton(i, 2) * (x1 - x0)),
+                            y0 + int(halton(i, 3) * (y1 - y0))))
+        return centers
+
+    @classmethod
+    def target_difficulty(cls, level):
+        return 0.05 + 0.35 * min(1.0, level / cls.GAME_CLEAR_STAGE)
+
+    # Solves the candidates in parallel and returns the index, trajectories
+    # and apples of the one closest to the target difficulty of the level,
+    # or None if cancelled is set first.
+    @classmethod
+    def choose(cls, level, candidates, cancelled=None):
+        jobs = [(solvers, cls.centers(len(solvers)),
+                 [(apple.x, apple.y) for apple in apples], cls.FLAME,
+                 cls.SOLVER_METHOD, cls.GEOMETRY)
+                for solvers, apples in candidates]
+        chosen = stage_generator.choose(
+            jobs, cls.target_difficulty(level), cls.CANDIDATE_BUDGET,
+            cancelled)
+        if chosen is None:
+            return None
+        i, results, s = chosen
+        solvers, apples = candidates[i]
+        seconds = s["seconds"] / len(results)
+        for key, result in zip(cls.cache_keys(solvers), results):
+            cls.CACHE.put(key, result, seconds)
+
+        return i, results, apples
 
     @classmethod
-    def generate(cls, level):
-        pendulum_num = min(cls.MAX_N_PENDULUM, level //
-                           cls.INCREASE_PENDULUM_STAGE + 1)
-        pendulums = []
-        for i in range(pendulum_num):
-            cx, cy = cls.PENDULUM_CENTERS[i]
-            n = pyxel.rndi(*cls.PENDULUM_RANGE)
-            pendulum = Pendulum(n, cx, cy, cls.FLAME)
-            pendulums.append(pendulum)
-        apples = [Apple.generate() for _ in range(Apple.NUM_PRE_STAGE)]
+    def load_packed(cls, level):
+        packed = cls.PACK.load(level, cls.FLAME)
+        if packed is None:
+            return None
+        results, apples = packed
+        return cls.build(results, [Apple(x, y) for x, y in apples])
+
+    # Keys of the pendulums of a stage, which are always solved together
+    @classmethod
+    def cache_keys(cls, solvers):
+        return [cls.CACHE.key(solvers, i, cls.FLAME, cls.SOLVER_METHOD)
+                for i in range(len(solvers))]
+
+    # Trajectories of the stage from the cache, or None unless every one of
+    # them is cached with all FLAME frames
+    @classmethod
+    def cached(cls, solvers):
+        results = [cls.CACHE.get(key) for key in cls.cache_keys(solvers)]
+        if any(result is None or len(result) != cls.FLAME
+               for result in results):
+            return None
+        return results
+
+    # Solves the stage unless all of it is cached. If the integrator gives
+    # up, the missing frames are solved with RK4. Safe to run on a worker
+    # thread.
+    @classmethod
+    def solve(cls, solvers):
+        results = cls.cached(solvers)
+        if results is None:
+            start = perf_counter()
+            results = pendulum.BatchPendulumSolver(solvers).solve(
+                cls.FLAME, cls.SOLVER_METHOD, recover=True)
+            seconds = (perf_counter() - start) / len(solvers)
+            for key, result in zip(cls.cache_keys(solvers), results):
+                cls.CACHE.put(key, result, seconds)
+
+        return results
+
+    @classmethod
+    def build(cls, results, apples, sources=None):
+        sources = sources or [None] * len(results)
+        if any(source is None and len(result) != cls.FLAME
+               for result, source in zip(results, sources)):
+            raise ValueError(f"a stage needs {cls.FLAME} frames")
+        pendulums = PendulumGroup.from_results(
+            results, cls.centers(len(results)), sources)
 
         return pendulums, apples
 
+    # Builds a stage that is playable right away. Unless the stage is
+    # cached, it is integrated a little every frame by advance(). If the
+    # integrator gives up mid-stage, the rest is integrated with RK4
+    # instead of stopping the frame loop.
+    @classmethod
+    def build_incremental(cls, solvers, apples):
+        results = cls.cached(solvers)
+        sources = [None] * len(solvers)
+        if results is None:
+            source = pendulum.IncrementalSolver(
+                pendulum.BatchPendulumSolver(solvers), cls.FLAME,
+                cls.SOLVER_METHOD, recover=True)
+            results = source.results
+            sources = [source] * len(solvers)
+
+        return cls.build(results, apples, sources)
+
+    @classmethod
+    def advance(cls, pendulums):
+        source = next((p.source for p in pendulums if p.source is not None),
+                      None)
+        if source is None:
+            return
+        source.advance(cls.SOLVE_BUDGET)
+        pendulums.sync()
+        if source.done():
+            seconds = source.seconds / len(source.results)
+            for key, result in zip(cls.cache_keys(source.batch.solvers),
+                                   source.results):
+                cls.CACHE.put(key, result, seconds)
+            for p in pendulums:
+                p.source = None
+
+    # Level, RNG, apples and trajectories for a session snapshot. The state
+    # of the pyxel RNG can't be read, so it is reseeded with a seed drawn
+    # from it, which the snapshot keeps. Trajectories that are still being
+    # integrated are left out, and the stage is generated again on resume.
+    @classmethod
+    def snapshot(cls, level, pendulums, apples):
+        seed = pyxel.rndi(0, 2**31 - 1)
+        pyxel.rseed(seed)
+        meta = {"level": level, "seed": seed, "stage_seed": cls.SEED,
+                "apples": [(apple.x, apple.y) for apple in apples],
+                "links": None}
+        arrays = {}
+        if pendulums and pendulums.complete():
+            meta["links"] = pendulums.links
+            arrays = {"trajectory": pendulums.trajectory,
+                      "boxes": pendulums.boxes}
+        return meta, arrays
+
+    # Returns the stage of a snapshot, or None if it has to be generated
+    @classmethod
+    def restore(cls, meta, arrays):
+        cls.SEED = meta["stage_seed"]
+        pyxel.rseed(meta["seed"])
+        if meta["links"] is None:
+            return None
+        pendulums = PendulumGroup(arrays["trajectory"], arrays["boxes"],
+                                  meta["links"])
+        return pendulums, [Apple(x, y) for x, y in meta["apples"]]
+
     @classmethod
     def clear(cls, apples):
         return all(apple.collected for apple in apples)
@@ -377,6 +762,79 @@ class Stage:
     def reset(cls, apples):
         for apple in apples:
             apple.collected = False
+        Layers.invalidate()
+
+
+class StagePrefetcher:
+    """
+    Solves the stage of the next level on a worker thread while the
+    current one is played.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.level = None
+        self.candidates = None
+        self.thread = None
+        self.stage = None
+        # Set to stop the solve of the worker
+        self.cancelled = threading.Event()
+        # Index of the candidate that the last take() returned
+        self.chosen = 0
+
+    def start(self, level):
+        if self.level == level:
+            return
+        self.cancel()
+        if Stage.PACK.contains(level, Stage.FLAME):
+            return
+        with self.lock:
+            self.level = level
+            self.candidates = Stage.random_candidates(level, Stage.CANDIDATES)
+            self.cancelled = threading.Event()
+        thread = threading.Thread(
+            target=self.run, args=(level, self.candidates, self.cancelled),
+            daemon=True)
+        try:
+            thread.start()
+        except RuntimeError:
+            # No threads (e.g. the web build): solve when the stage is needed
+            return
+        self.thread = thread
+
+    def run(self, level, candidates, cancelled):
+        try:
+            stage = Stage.choose(level, candidates, cancelled)
+        except pendulum.IntegrationError:
+            return
+        with self.lock:
+            if self.candidates is candidates:
+                self.stage = stage
+
+    def cancel(self):
+        # Stops the processes solving the candidates
+        with self.lock:
+            self.cancelled.set()
+            self.level = None
+            self.candidates = None
+            self.thread = None
+            self.stage = None
+
+    # Returns the prefetched stage of the level, or None if the level was
+    # not prefetched. If the worker hasn't finished or there is no worker,
+    # the first candidate is solved incrementally instead of waiting, and
+    # the worker's result is dropped.
+    def take(self, level):
+        if self.level != level:
+            return None
+        with self.lock:
+            candidates, stage = self.candidates, self.stage
+        self.cancel()
+        if stage is None:
+            self.chosen = 0
+            return Stage.build_incremental(*candidates[0])
+        self.chosen, results, apples = stage
+        return Stage.build(results, apples)
 
 
 class GameState(Enum):
@@ -557,15 +1015,129 @@ class BackToMainMenuUI(UIBase):
         pass
 
 
+class Layers:
+    """
+    Parts of the stage that don't move, prerendered into image bank BANK
+    so that each is drawn with one blt (color 0 is transparent).
+
+    The level number is redrawn when the level changes. The start point
+    and the apples are redrawn after invalidate(), which is called when
+    a stage is loaded and when apples are collected or reset.
+    """
+
+    BANK = 0
+    TEXT_Y = (FLOOR + WINDOW_H) // 2
+    TEXT_H = 6
+    STAGE_V = 8  # Row of the bank where the start point and apples start
+
+    level = None
+    dirty = True
+
+    @classmethod
+    def invalidate(cls):
+        cls.dirty = True
+
+    @classmethod
+    def draw_level(cls, level, canvas=pyxel):
+        bank = pyxel.images[cls.BANK]
+        if level != cls.level:
+            s = f"{level}"
+            bank.rect(0, 0, WINDOW_W, cls.TEXT_H, 0)
+            bank.text(center(s, WINDOW_W), 0, s, 7)
+            cls.level = level
+        canvas.blt(0, cls.TEXT_Y, bank, 0, 0, WINDOW_W, cls.TEXT_H, 0)
+
+    @classmethod
+    def draw_stage(cls, apples):
+        bank = pyxel.images[cls.BANK]
+        if cls.dirty:
+            bank.rect(0, cls.STAGE_V, WINDOW_W, WINDOW_H, 0)
+            bank.camera(0, -cls.STAGE_V)
+            StartPoint.draw(bank)
+            for apple in apples:
+                if apple.collected:
+                    continue
+                apple.draw(bank)
+            bank.camera()
+            cls.dirty = False
+        pyxel.blt(0, 0, bank, 0, cls.STAGE_V, WINDOW_W, WINDOW_H, 0)
+
+
+class Playfield:
+    """
+    Draws the pendulums, after-images and level number once into an
+    offscreen image, then copies it to the screen twice: above the split
+    as is, and below it through a palette that swaps gradation color c
+    for 7 - c, which is what drawing again with reverse=True produces.
+    Rods and joint outlines are 7 in both halves, so they are drawn with
+    the spare color STROKE that both palettes map to 7.
+    """
+
+    STROKE = 15
+    image = None
+
+    @classmethod
+    def draw(cls, pendulums, level, split):
+        if cls.image is None:
+            cls.image = pyxel.Image(WINDOW_W, WINDOW_H)
+        canvas = cls.image
+        with profiler.Profiler.section("draw_scene"):
+            canvas.cls(0)
+            pendulums.draw(canvas=canvas, stroke=cls.STROKE)
+            AfterImage.draw(canvas=canvas)
+            pendulums.draw_tips(canvas=canvas)
+            Layers.draw_level(level, canvas)
+
+        with profiler.Profiler.section("draw_blit"):
+            pyxel.pal(cls.STROKE, 7)
+            pyxel.blt(0, 0, canvas, 0, 0, WINDOW_W, split)
+            for c in range(len(GRADATION)):
+                pyxel.pal(c, len(GRADATION) - 1 - c)
+            pyxel.blt(0, split, canvas, 0, split, WINDOW_W, WINDOW_H - split)
+            pyxel.pal()
+
+
 class App:
+    # States after which the session is saved
+    SNAPSHOT_STATES = ("PLAYING", "STAGE_CLEAR", "GAME_CLEAR", "GAME_OVER",
+                       "BACK_TO_MAIN_MENU")
+
     def __init__(self):
         pyxel.init(WINDOW_W, WINDOW_H)
+        profiler.Startup.mark("pyxel.init")
         for i, c in enumerate(GRADATION):
             pyxel.colors[i] = c
 
         image.load_images()
+        profiler.Startup.mark("title image")
+        if not lazy.preload(NUMERICAL_MODULES, lambda: profiler.Startup.mark(
+                "numerical modules")):
+            profiler.Startup.waiting.discard("numerical modules")
 
         self.initialize()
+        # (frame, event) of state changes, deaths, collected apples and
+        # generated stages, kept while recording or replaying
+        self.events = None
+        self.frames = 0
+        self.recorder = None
+        if os.environ.get("THROUGHNPENDULUM_RECORD"):
+            import replay
+            self.recorder = replay.Recorder(
+                os.environ["THROUGHNPENDULUM_RECORD"], Stage)
+            self.events = []
+
+        # Snapshot that "Continue" resumes after a restart. Only its header
+        # is read here, the trajectories are memory-mapped on resume.
+        # Recordings start from the title without one.
+        path = None if self.recorder else session.default_path()
+        self.session = path and session.SessionWriter(path)
+        self.resume = None
+        if path and os.path.exists(path):
+            try:
+                self.resume = session.read_header(path)
+                self.level = self.resume["level"]
+            except (OSError, ValueError, KeyError, session.SessionError):
+                self.resume = None
         pyxel.run(self.update, self.draw)
 
     def initialize(self):
@@ -575,6 +1147,7 @@ class App:
         self.character = Character()
         self.count = 0
         self.status = GameState.MAIN_MENU
+        self.prefetcher = StagePrefetcher()
         AfterImage.clear()
         MainMenuUI.reset()
         ReadyStageUI.reset()
@@ -582,19 +1155,42 @@ class App:
         GameOverUI.reset()
 
     def update(self):
+        if pyxel.btnp(pyxel.KEY_F3):
+            profiler.Profiler.toggle()
+        if pyxel.btnp(pyxel.KEY_F2) and profiler.Profiler.enabled:
+            profiler.Profiler.export_csv("profile.csv")
+        image.load_pending()
+        if self.recorder is not None:
+            self.recorder.capture()
+        with profiler.Profiler.section("update"):
+            self.update_game()
+        self.frames += 1
+
+    def record(self, event):
+        if self.events is None:
+            return
+        self.events.append((self.frames, event))
+        if self.recorder is not None and event in GameState.__members__:
+            self.recorder.save(self.events)
+
+    def update_game(self):
+        with profiler.Profiler.section("stage"):
+            Stage.advance(self.pendulums)
         match self.status:
             case GameState.MAIN_MENU:
                 MainMenuUI.continue_stage(self.level > 0)
                 state = MainMenuUI.update()
                 if state and MainMenuUI.selected_button() == MainMenuUI.start_button:
                     self.level = 1
+                    self.resume = None
                     self.clear_stage()
                 self.update_status(state)
 
             case GameState.READY_STAGE:
                 state = ReadyStageUI.update()
                 if not self.is_existed_stage():
-                    self.generate_stage()
+                    with profiler.Profiler.section("stage"):
+                        self.generate_stage()
                 self.update_status(state)
 
             case GameState.PLAYING:
@@ -603,17 +1199,22 @@ class App:
                     self.update_status(GameState.GAME_OVER)
                     return
 
-                for pendulum in self.pendulums:
-                    pendulum.update(self.count)
+                with profiler.Profiler.section("pendulums"):
+                    self.pendulums.update(self.count)
                 self.character.update()
-                AfterImage.update()
-                if not self.character.collision_to_startpoint():
-                    for pendulum in self.pendulums:
-                        if self.character.collision_to_pendulum(*pendulum.tip_position()) and not self.character.is_dead():
+                with profiler.Profiler.section("afterimage"):
+                    AfterImage.update()
+                with profiler.Profiler.section("collision"):
+                    if not self.character.collision_to_startpoint():
+                        if self.collision_to_pendulums() and not self.character.is_dead():
                             self.character.dead()
+                            self.record("DEAD")
                             self.restart()
                 for apple in self.apples:
                     if self.character.collision_to_apple(apple) and not self.character.is_dead():
+                        if not apple.collected:
+                            Layers.invalidate()
+                            self.record("APPLE")
                         apple.collected = True
 
                 if self.character.collision_to_startpoint():
@@ -639,11 +1240,43 @@ class App:
                 state = BackToMainMenuUI.update()
                 self.update_status(state)
 
+    def collision_to_pendulums(self):
+        if Stage.FULL_COLLISION:
+            return self.character.collision_to_linkages(self.pendulums)
+        return self.character.collision_to_tips(self.pendulums)
+
     def is_existed_stage(self):
         return len(self.pendulums) > 0
 
     def generate_stage(self):
-        self.pendulums, self.apples = Stage.generate(self.level)
+        stage = self.resume_stage()
+        chosen = 0
+        if stage is None:
+            stage = self.prefetcher.take(self.level)
+            chosen = self.prefetcher.chosen
+        if stage is None:
+            # The packed stage, or the first candidate
+            stage = Stage.generate(self.level, incremental=True)
+            chosen = 0
+        self.pendulums, self.apples = stage
+        self.record(f"STAGE {self.level} {chosen}")
+        Layers.invalidate()
+
+    # The stage of the snapshot read at start-up, after "Continue"
+    def resume_stage(self):
+        meta, self.resume = self.resume, None
+        if meta is None or meta["level"] != self.level:
+            return None
+        try:
+            arrays = session.open_arrays(self.session.path, meta)
+        except (OSError, ValueError):
+            return None
+        return Stage.restore(meta, arrays)
+
+    def save_session(self):
+        if self.session is not None:
+            self.session.save(*Stage.snapshot(self.level, self.pendulums,
+                                              self.apples))
 
     def reset_stage(self):
         self.character.reset()
@@ -663,6 +1296,7 @@ class App:
     def update_status(self, status):
         if status:
             self.status = status
+            self.record(status.name)
         match status:
             case GameState.MAIN_MENU:
                 MainMenuUI.reset()
@@ -670,6 +1304,7 @@ class App:
                 ReadyStageUI.reset()
             case GameState.PLAYING:
                 self.reset_stage()
+                self.prefetcher.start(self.level + 1)
             case GameState.STAGE_CLEAR:
                 self.level += 1
                 self.clear_stage()
@@ -685,9 +1320,21 @@ class App:
                 AfterImage.clear()
             case GameState.BACK_TO_MAIN_MENU:
                 BackToMainMenuUI.reset()
+                self.prefetcher.cancel()
+        if status and status.name in self.SNAPSHOT_STATES:
+            self.save_session()
 
     def draw(self):
-        pyxel.cls(0)
+        with profiler.Profiler.section("draw"):
+            self.draw_game()
+        profiler.Profiler.draw()
+        profiler.Profiler.end_frame()
+        profiler.Startup.frame()
+
+    def draw_game(self):
+        # The composited stage covers the whole screen
+        if self.status != GameState.PLAYING or not Stage.COMPOSITE:
+            pyxel.cls(0)
         match self.status:
             case GameState.MAIN_MENU:
                 MainMenuUI.draw()
@@ -700,32 +1347,13 @@ class App:
             case GameState.PLAYING:
                 draw_split = WINDOW_H * self.count // Stage.FLAME
 
-                pyxel.clip(0, 0, WINDOW_W, draw_split)
-                pyxel.rect(0, 0, WINDOW_W, draw_split, 0)
-                for pendulum in self.pendulums:
-                    pendulum.draw()
-                AfterImage.draw()
-                for pendulum in self.pendulums:
-                    pendulum.draw_tip()
-                s = f"{self.level}"
-                pyxel.text(center(s, WINDOW_W), (FLOOR + WINDOW_H) // 2, s, 7)
-
-                pyxel.clip(0, draw_split, WINDOW_W, WINDOW_H - draw_split)
-                pyxel.rect(0, draw_split, WINDOW_W, WINDOW_H - draw_split, 7)
-                for pendulum in self.pendulums:
-                    pendulum.draw(reverse=True)
-                AfterImage.draw(reverse=True)
-                for pendulum in self.pendulums:
-                    pendulum.draw_tip(reverse=True)
-                s = f"{self.level}"
-                pyxel.text(center(s, WINDOW_W), (FLOOR + WINDOW_H) // 2, s, 0)
+                if Stage.COMPOSITE:
+                    Playfield.draw(self.pendulums, self.level, draw_split)
+                else:
+                    self.draw_playfield(draw_split)
 
                 pyxel.clip()
-                StartPoint.draw()
-                for apple in self.apples:
-                    if apple.collected:
-                        continue
-                    apple.draw()
+                Layers.draw_stage(self.apples)
                 self.character.draw()
 
                 pyxel.line(0, FLOOR, WINDOW_W, FLOOR, 9)
@@ -733,5 +1361,30 @@ class App:
                 GameOverUI.draw()
         pyxel.text(4, WINDOW_H - 8, "A\D\SPACE", 4)
 
-
-App()
+    # Draws both halves of the stage with separate draw calls, both timed
+    # as draw_scene
+    def draw_playfield(self, draw_split):
+        with profiler.Profiler.section("draw_scene"):
+            pyxel.clip(0, 0, WINDOW_W, draw_split)
+            pyxel.rect(0, 0, WINDOW_W, draw_split, 0)
+            self.pendulums.draw()
+            AfterImage.draw()
+            self.pendulums.draw_tips()
+            s = f"{self.level}"
+            pyxel.text(center(s, WINDOW_W),
+                       (FLOOR + WINDOW_H) // 2, s, 7)
+
+        with profiler.Profiler.section("draw_scene"):
+            pyxel.clip(0, draw_split, WINDOW_W, WINDOW_H - draw_split)
+            pyxel.rect(0, draw_split, WINDOW_W,
+                       WINDOW_H - draw_split, 7)
+            self.pendulums.draw(reverse=True)
+            AfterImage.draw(reverse=True)
+            self.pendulums.draw_tips(reverse=True)
+            s = f"{self.level}"
+            pyxel.text(center(s, WINDOW_W),
+                       (FLOOR + WINDOW_H) // 2, s, 0)
+
+
+if __name__ == "__main__":
+    App()
@@ -1,6 +1,252 @@
-from scipy.integrate import solve_ivp
+import math
+from time import perf_counter
+
 import numpy
 
+import compiled
+
+# Integrators that step on the frame grid without scipy
+FIXED_STEP_METHODS = ('RK4',)
+RK4_SUBSTEPS = 2
+# solve_ivp methods that use the Jacobian of the right-hand side
+IMPLICIT_METHODS = ('Radau', 'BDF', 'LSODA')
+# From this many links on, explicit methods use the O(n) eom_chain. Shorter
+# chains keep the mass matrix so cached and packed stages stay the same
+CHAIN_LINKS = 10
+# Whether the equations of motion and kinematics run in the Numba kernels of
+# compiled.py. Their results differ from NumPy in the last bits.
+COMPILED = compiled.ENABLED
+
+
+class IntegrationError(RuntimeError):
+    """
+    An adaptive integrator gave up before the end of the time span, e.g.
+    because the step size it needed became too small.
+
+    Attributes:
+        ys (array): States of the frames reached before it gave up, shape
+            (len(y0), frames), or None if unknown.
+    """
+
+    def __init__(self, message, ys=None):
+        super().__init__(message)
+        self.ys = ys
+
+
+def rk4(fun, y0, t_eval, substeps=RK4_SUBSTEPS):
+    """
+    Integrate with the classic fixed-step Runge-Kutta method.
+
+    Each interval between two evaluation times is split into `substeps`
+    equal steps, so the result lands exactly on the frame grid.
+
+    Parameters:
+        fun (callable): Right-hand side fun(t, y).
+        y0 (array): Initial state.
+        t_eval (array): Evenly spaced times to evaluate, starting at 0.
+        substeps (int): Number of steps between two evaluation times.
+
+    Returns:
+        array: States with shape (len(y0), len(t_eval)).
+    """
+    ys = numpy.empty((len(y0), len(t_eval)))
+    y = numpy.array(y0, dtype=float)
+    ys[:, 0] = y
+    for i in range(1, len(t_eval)):
+        y = rk4_step(fun, t_eval[i - 1], t_eval[i], y, substeps)
+        ys[:, i] = y
+    return ys
+
+
+def rk4_step(fun, t0, t1, y, substeps=RK4_SUBSTEPS):
+    """
+    Advance y from t0 to t1 with `substeps` fixed Runge-Kutta steps.
+    """
+    t = t0
+    h = (t1 - t0) / substeps
+    for _ in range(substeps):
+        k1 = fun(t, y)
+        k2 = fun(t + h / 2, y + h / 2 * k1)
+        k3 = fun(t + h / 2, y + h / 2 * k2)
+        k4 = fun(t + h, y + h * k3)
+        y = y + h / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+        t += h
+    return y
+
+
+def integrate(fun, time, y0, flame, method='RK45', rtol=1e-3, atol=1e-6,
+              jac=None, vectorized=False, substeps=None):
+    """
+    Integrate fun from 0 to time and sample `flame` evenly spaced states.
+
+    Parameters:
+        fun (callable): Right-hand side fun(t, y).
+        time (float): Time duration.
+        y0 (array): Initial state.
+        flame (int): Number of time points to evaluate.
+        method (str): 'RK4' for the fixed-step integrator, 'auto' for LSODA,
+            which detects stiffness and switches between a non-stiff and a
+            stiff method, otherwise the name of a scipy.integrate.solve_ivp
+            method.
+        rtol (float): Relative tolerance of adaptive methods.
+        atol (float): Absolute tolerance of adaptive methods.
+        jac (callable): Jacobian jac(t, y) used by the implicit methods.
+        vectorized (bool): Whether fun accepts states with shape (len(y0), k).
+        substeps (int): Steps per frame of 'RK4', RK4_SUBSTEPS by default.
+
+    Returns:
+        array: States with shape (len(y0), flame).
+
+    Raises:
+        IntegrationError: If an adaptive method doesn't reach the end.
+    """
+    t_eval = numpy.linspace(0, time, flame)
+    if method in FIXED_STEP_METHODS:
+        return rk4(fun, y0, t_eval, substeps or RK4_SUBSTEPS)
+    if method == 'auto':
+        method = 'LSODA'
+
+    options = {}
+    if method in IMPLICIT_METHODS:
+        options['vectorized'] = vectorized
+        if jac is not None:
+            options['jac'] = jac
+
+    from scipy.integrate import solve_ivp
+    sol = solve_ivp(fun, (0, time), y0, t_eval=t_eval, method=method,
+                    rtol=rtol, atol=atol, **options)
+    if sol.status != 0 or sol.y.shape[1] != flame:
+        raise IntegrationError(sol.message, sol.y)
+    return sol.y
+
+
+def forward_kinematics(lengths, angles):
+    """
+    Positions of the links of a pendulum hanging from the origin.
+
+    Parameters:
+        lengths (array): Length of each link, shape (n,).
+        angles (array): Angles of each link, shape (..., n), e.g. one row
+            per time step.
+
+    Returns:
+        array: Positions (x, y) of each link, shape (..., n, 2).
+    """
+    angles = numpy.asarray(angles, dtype=float)
+    if COMPILED and angles.ndim == 2:
+        return compiled.forward_kinematics(lengths,
+                                           numpy.ascontiguousarray(angles))
+    positions = numpy.empty(angles.shape + (2,))
+    numpy.cumsum(lengths * numpy.sin(angles), axis=-1, out=positions[..., 0])
+    numpy.cumsum(-lengths * numpy.cos(angles), axis=-1, out=positions[..., 1])
+    return positions
+
+
+class IncrementalSolver:
+    """
+    Integrate a BatchPendulumSolver a few steps at a time.
+
+    The positions of each pendulum are appended to `results` as frames are
+    computed, so a stage can be played while the rest of the trajectories
+    are still being integrated. Adaptive methods step through the scipy
+    solver objects and sample their dense output on the frame grid, which
+    gives the same frames as solve_ivp.
+
+    If an adaptive method gives up, step() raises IntegrationError, or
+    with `recover` the missing frames are taken from a solve of the whole
+    batch with RK4, which can't give up. The frames computed so far are
+    kept, so the pendulums jump once at the frame where it failed.
+    """
+
+    def __init__(self, batch, flame, method='RK45', rtol=1e-3, atol=1e-6,
+                 recover=False):
+        self.batch = batch
+        self.flame = flame
+        self.recover = recover
+        self.t_eval = numpy.linspace(0, batch.time, flame)
+        self.results = [[] for _ in batch.solvers]
+        self.y = batch.initial_state()
+        # Time spent in advance() and advance_to()
+        self.seconds = 0.0
+
+        if method == 'auto':
+            method = 'LSODA'
+        if method in FIXED_STEP_METHODS:
+            self.solver = None
+            self.append(self.y[:, None])
+        else:
+            import scipy.integrate
+            options = {}
+            if method in IMPLICIT_METHODS:
+                options['jac'] = batch.jac
+            self.solver = getattr(scipy.integrate, method)(
+                batch.eom, 0, self.y, batch.time,
+                rtol=rtol * batch.tolerance_scale,
+                atol=atol * batch.tolerance_scale, **options)
+
+    def horizon(self):
+        """
+        Returns:
+            int: Number of frames computed so far.
+        """
+        return len(self.results[0])
+
+    def done(self):
+        return self.horizon() >= self.flame
+
+    def append(self, ys):
+        for result, positions in zip(self.results, self.batch.split(ys)):
+            result.extend(positions)
+
+    def step(self):
+        """
+        Advance the integration by one step of the integrator.
+        """
+        i = self.horizon()
+        if self.solver is None:
+            self.y = rk4_step(self.batch.eom, self.t_eval[i - 1],
+                              self.t_eval[i], self.y)
+            self.append(self.y[:, None])
+            return
+
+        message = self.solver.step()
+        if self.solver.status == 'failed':
+            if not self.recover:
+                raise IntegrationError(message, None)
+            self.fall_back()
+            return
+        j = numpy.searchsorted(self.t_eval, self.solver.t, side='right')
+        if j > i:
+            self.append(self.solver.dense_output()(self.t_eval[i:j]))
+
+    def fall_back(self):
+        """
+        Fill in the missing frames with RK4 after the adaptive method gave
+        up. The state it reached is usually far off by then, so RK4 starts
+        over from the initial state.
+        """
+        ys = self.batch.integrate(self.flame, 'RK4')
+        self.append(ys[:, self.horizon():])
+        self.solver = None
+
+    def advance(self, budget):
+        """
+        Integrate until `budget` seconds have passed or all frames exist.
+        """
+        start = perf_counter()
+        while not self.done() and perf_counter() - start < budget:
+            self.step()
+        self.seconds += perf_counter() - start
+
+    def advance_to(self, frame):
+        """
+        Integrate until the given frame exists.
+        """
+        start = perf_counter()
+        while not self.done() and self.horizon() <= frame:
+            self.step()
+        self.seconds += perf_counter() - start
+
 
 class PendulumSolver:
     def __init__(self, lenth_list, weight_list, time, init_angles, init_velocities):
@@ -10,10 +256,152 @@ class PendulumSolver:
         self.init_angles = init_angles
         self.init_velocities = init_velocities
 
+        n = len(lenth_list)
+        self.lengths = numpy.asarray(lenth_list, dtype=float)
+        self.suffix_weights = numpy.cumsum(
+            numpy.asarray(weight_list, dtype=float)[::-1])[::-1]
+        index = numpy.arange(n)
+        self.mass = self.suffix_weights[numpy.maximum(
+            index[:, None], index[None, :])]
+        self.inverse_weights = 1.0 / numpy.asarray(weight_list, dtype=float)
+
     def eom(self, t, y):
         """
         Equations of motion for the pendulum system.
 
+        The mass matrix is built from suffix sums of the weights and
+        broadcast cos/sin of the angle differences, and the accelerations
+        are obtained by solving the linear system instead of inverting it.
+
+        Parameters:
+            t (float): Time variable.
+            y (array): State vector containing angles and angular velocities,
+                or several state vectors as columns of a (2 * n, k) array.
+
+        Returns:
+            array: Derivatives of the state vector, with the shape of y.
+        """
+        g = 9.81
+
+        n = len(self.lenth_list)
+        x = y[:n].T
+        v = y[n:].T
+
+        d = x[..., :, None] - x[..., None, :]
+        ML = self.mass * self.lengths
+        A = ML * numpy.cos(d)
+        b = (ML * (v**2)[..., None, :] * numpy.sin(d)).sum(axis=-1) + \
+            self.suffix_weights * g * numpy.sin(x)
+        a = numpy.linalg.solve(A, b[..., None])[..., 0]
+
+        return numpy.concatenate([v, -a], axis=-1).T
+
+    def jac(self, t, y):
+        """
+        Analytic Jacobian of eom with respect to the state vector.
+
+        Parameters:
+            t (float): Time variable.
+            y (array): State vector containing angles and angular velocities.
+
+        Returns:
+            array: Jacobian with shape (2 * n, 2 * n).
+        """
+        g = 9.81
+
+        n = len(self.lenth_list)
+        x = y[:n]
+        v = y[n:]
+
+        d = x[:, None] - x[None, :]
+        ML = self.mass * self.lengths
+        C = ML * numpy.cos(d)
+        S = ML * numpy.sin(d)
+        b = (S * v**2).sum(axis=1) + self.suffix_weights * g * numpy.sin(x)
+        a = -numpy.linalg.solve(C, b)
+
+        # Derivatives of (A @ a + b) with the accelerations held fixed
+        dx = S * a - C * v**2
+        dx[numpy.diag_indices(n)] += -(S @ a) + C @ v**2 + \
+            self.suffix_weights * g * numpy.cos(x)
+        dv = 2 * S * v
+
+        J = numpy.zeros((2 * n, 2 * n))
+        J[:n, n:] = numpy.eye(n)
+        J[n:] = -numpy.linalg.solve(C, numpy.hstack([dx, dv]))
+        return J
+
+    def eom_chain(self, t, y):
+        """
+        Equations of motion in linear time, for long chains.
+
+        Instead of the n x n mass matrix, the tensions of the rods are
+        solved for. Each rod keeps its length, which gives one equation per
+        rod coupling only its neighbours, so the tensions are a tridiagonal
+        system solved with one forward and one backward sweep. The angular
+        accelerations then follow from the forces on each bob. The sweeps
+        run over Python floats, which is faster than numpy for the scalar
+        recurrences.
+
+        Parameters:
+            t (float): Time variable.
+            y (array): State vector containing angles and angular velocities,
+                or several state vectors as columns of a (2 * n, k) array.
+
+        Returns:
+            array: Derivatives of the state vector, with the shape of y.
+        """
+        if numpy.ndim(y) == 2:
+            return numpy.column_stack([self.eom_chain(t, c) for c in y.T])
+        g = 9.81
+        cos, sin = math.cos, math.sin
+
+        n = len(self.lenth_list)
+        x = y[:n].tolist()
+        v = y[n:].tolist()
+        lengths = self.lengths.tolist()
+        w = self.inverse_weights.tolist()
+
+        # Forward sweep of the tension equations
+        # -T[k-1] c[k-1] w[k-1] + T[k] (w[k] + w[k-1]) - T[k+1] c[k] w[k]
+        #     = l[k] v[k]**2 (+ g cos x[0] for the first rod)
+        c = [cos(x[k + 1] - x[k]) for k in range(n - 1)]
+        upper, rhs = [0.0] * n, [0.0] * n
+        above = lower = 0.0
+        for k in range(n):
+            diagonal = w[k] + (w[k - 1] if k else 0.0) - lower * above
+            off = -c[k] * w[k] if k < n - 1 else 0.0
+            r = lengths[k] * v[k] * v[k] - lower * rhs[k - 1]
+            if k == 0:
+                r += g * cos(x[0])
+            upper[k] = above = off / diagonal
+            rhs[k] = r / diagonal
+            lower = off
+        tension = rhs
+        for k in range(n - 2, -1, -1):
+            tension[k] -= upper[k] * tension[k + 1]
+
+        # Tangential forces of the neighbouring rods on each bob
+        a = [0.0] * n
+        for k in range(n - 1):
+            s = sin(x[k + 1] - x[k])
+            a[k] += tension[k + 1] * s * w[k]
+            a[k + 1] -= tension[k] * s * w[k]
+        a[0] -= g * sin(x[0])
+        return numpy.array(v + [a[k] / lengths[k] for k in range(n)])
+
+    def eom_compiled(self, t, y):
+        """
+        eom_chain in the compiled kernel, for one state vector.
+        """
+        return compiled.eom(y, self.lengths, self.inverse_weights)
+
+    def eom_loop(self, t, y):
+        """
+        Reference equations of motion built with explicit loops.
+
+        Kept to check the vectorized eom against.
+
         Parameters:
             t (float): Time variable.
             y (array): State vector containing angles and angular velocities.
@@ -44,33 +432,230 @@ class PendulumSolver:
 
         return numpy.concatenate([v, -numpy.linalg.inv(A) @ B @ numpy.ones(n)])
 
-    def solve(self, flame):
+    def initial_state(self):
+        return numpy.concatenate([self.init_angles, self.init_velocities])
+
+    def integrate(self, flame, method='RK45', rtol=1e-3, atol=1e-6):
+        """
+        Integrate the equations of motion using the initial conditions.
+        Parameters:
+            flame (int): Number of time points to evaluate.
+            method (str): Integrator, see integrate(). Explicit methods use
+                the compiled kernel if COMPILED, otherwise eom_chain for
+                chains of CHAIN_LINKS or more links.
+            rtol (float): Relative tolerance of the integrator.
+            atol (float): Absolute tolerance of the integrator.
+
+        Returns:
+            array: States with shape (2 * n, flame).
+        """
+        fun = self.eom
+        if method not in IMPLICIT_METHODS + ('auto',):
+            if COMPILED:
+                fun = self.eom_compiled
+            elif len(self.lenth_list) >= CHAIN_LINKS:
+                fun = self.eom_chain
+        return integrate(fun, self.time, self.initial_state(), flame,
+                         method, rtol, atol, jac=self.jac, vectorized=True)
+
+    def solve(self, flame, method='RK45', rtol=1e-3, atol=1e-6):
         """
         Solve the equations of motion using the initial conditions.
         Parameters:
             flame (int): Number of time points to evaluate.
+            method (str): Integrator, see integrate().
+            rtol (float): Relative tolerance of the integrator.
+            atol (float): Absolute tolerance of the integrator.
 
         Returns:
-            list: A list of positions (x, y) for each pendulum at each time step.
+            array: Positions (x, y) of each link at each time step, with
+                shape (flame, n, 2).
         """
-        y0 = numpy.concatenate([self.init_angles, self.init_velocities])
-        t_span = (0, self.time)
-        t_eval = numpy.linspace(0, self.time, flame)
+        ys = self.integrate(flame, method, rtol, atol)
+        return self.positions(ys[:len(self.lenth_list)].T)
 
-        sol = solve_ivp(self.eom, t_span, y0, t_eval=t_eval, method='RK45')
+    def energy(self, ys):
+        """
+        Total mechanical energy of the pendulum system.
+        Parameters:
+            ys (array): States with shape (2 * n, flame).
 
-        positions = []
-        for pos in sol.y.T:
-            position = []
-            bx, by = 0, 0
-            for i in range(len(self.lenth_list)):
-                px = self.lenth_list[i] * numpy.sin(pos[i]) + bx
-                py = -self.lenth_list[i] * numpy.cos(pos[i]) + by
-                position.append((px, py))
-                bx, by = px, py
-            positions.append(position)
+        Returns:
+            array: Energy at each time step.
+        """
+        g = 9.81
 
-        return positions
+        n = len(self.lenth_list)
+        x, v = ys[:n], ys[n:]
+        lengths = self.lengths[:, None]
+        weights = numpy.asarray(self.weight_list, dtype=float)[:, None]
+        vx = numpy.cumsum(lengths * numpy.cos(x) * v, axis=0)
+        vy = numpy.cumsum(lengths * numpy.sin(x) * v, axis=0)
+        py = numpy.cumsum(-lengths * numpy.cos(x), axis=0)
+        return (weights * (0.5 * (vx**2 + vy**2) + g * py)).sum(axis=0)
+
+    def positions(self, angles):
+        """
+        Convert angles into positions of each link.
+        Parameters:
+            angles (array): Angles of each link at each time step.
+
+        Returns:
+            array: Positions (x, y) of each link at each time step, with
+                shape (flame, n, 2).
+        """
+        return forward_kinematics(self.lengths, angles)
+
+
+class BatchPendulumSolver:
+    """
+    Integrate several pendulums with different numbers of links at once.
+
+    The states of all pendulums are stacked into one vector and the
+    equations of motion are evaluated for every pendulum in one batched
+    call, with shorter chains padded to the longest one.
+
+    Adaptive methods control the RMS error of the whole stacked state, in
+    which the error of one pendulum is diluted by all the others. Their
+    tolerances are multiplied by `tolerance_scale`, so that the error of
+    each pendulum stays within the tolerances as if it were solved alone.
+    """
+
+    def __init__(self, solvers):
+        self.solvers = solvers
+        self.time = max(solver.time for solver in solvers)
+
+        counts = [len(solver.lenth_list) for solver in solvers]
+        k, n = len(solvers), max(counts)
+
+        self.lengths = numpy.zeros((k, n))
+        self.suffix_weights = numpy.zeros((k, n))
+        self.inverse_weights = numpy.zeros((k, n))
+        self.mass = numpy.zeros((k, n, n))
+        self.padding = numpy.zeros((k, n, n))
+        self.valid = numpy.zeros((k, n), dtype=bool)
+        angle_index, velocity_index = [], []
+        offset = 0
+        for i, (solver, m) in enumerate(zip(solvers, counts)):
+            self.lengths[i, :m] = solver.lengths
+            self.suffix_weights[i, :m] = solver.suffix_weights
+            self.inverse_weights[i, :m] = solver.inverse_weights
+            self.mass[i, :m, :m] = solver.mass
+            self.padding[i, range(m, n), range(m, n)] = 1.0
+            self.valid[i, :m] = True
+            angle_index.extend(range(offset, offset + m))
+            velocity_index.extend(range(offset + m, offset + 2 * m))
+            offset += 2 * m
+        self.angle_index = numpy.array(angle_index)
+        self.velocity_index = numpy.array(velocity_index)
+        self.offsets = numpy.cumsum([0] + [2 * m for m in counts])
+        # A pendulum with s of the S stacked states has an RMS error of at
+        # most sqrt(S / s) times that of the stack
+        self.tolerance_scale = math.sqrt(2 * min(counts) / self.offsets[-1])
+
+    def initial_state(self):
+        return numpy.concatenate([
+            numpy.concatenate([solver.init_angles, solver.init_velocities])
+            for solver in self.solvers])
+
+    def eom(self, t, y):
+        """
+        Equations of motion for all pendulums.
+
+        Parameters:
+            t (float): Time variable.
+            y (array): Stacked state vectors of all pendulums.
+
+        Returns:
+            array: Derivatives of the stacked state vector.
+        """
+        if COMPILED:
+            return compiled.batch_eom(y, self.offsets, self.lengths,
+                                      self.inverse_weights)
+        g = 9.81
+
+        x = numpy.zeros(self.valid.shape)
+        v = numpy.zeros(self.valid.shape)
+        x[self.valid] = y[self.angle_index]
+        v[self.valid] = y[self.velocity_index]
+
+        d = x[:, :, None] - x[:, None, :]
+        ML = self.mass * self.lengths[:, None, :]
+        A = ML * numpy.cos(d) + self.padding
+        b = (ML * (v**2)[:, None, :] * numpy.sin(d)).sum(axis=2) + \
+            self.suffix_weights * g * numpy.sin(x)
+        a = numpy.linalg.solve(A, b[:, :, None])[:, :, 0]
+
+        dy = numpy.empty_like(y)
+        dy[self.angle_index] = v[self.valid]
+        dy[self.velocity_index] = -a[self.valid]
+        return dy
+
+    def jac(self, t, y):
+        """
+        Block-diagonal Jacobian of eom built from each pendulum's Jacobian.
+
+        Parameters:
+            t (float): Time variable.
+            y (array): Stacked state vectors of all pendulums.
+
+        Returns:
+            array: Jacobian with shape (len(y), len(y)).
+        """
+        J = numpy.zeros((len(y), len(y)))
+        for solver, start, end in zip(self.solvers, self.offsets[:-1],
+                                      self.offsets[1:]):
+            J[start:end, start:end] = solver.jac(t, y[start:end])
+        return J
+
+    def integrate(self, flame, method='RK45', rtol=1e-3, atol=1e-6):
+        """
+        Integrate the equations of motion of all pendulums.
+        Parameters:
+            flame (int): Number of time points to evaluate.
+            method (str): Integrator, see integrate().
+            rtol (float): Relative tolerance for each pendulum.
+            atol (float): Absolute tolerance for each pendulum.
+
+        Returns:
+            array: Stacked states with shape (len(state), flame).
+        """
+        return integrate(self.eom, self.time, self.initial_state(), flame,
+                         method, rtol * self.tolerance_scale,
+                         atol * self.tolerance_scale, jac=self.jac)
+
+    def solve(self, flame, method='RK45', rtol=1e-3, atol=1e-6,
+              recover=False):
+        """
+        Solve the equations of motion of all pendulums.
+        Parameters:
+            flame (int): Number of time points to evaluate.
+            method (str): Integrator, see integrate().
+            rtol (float): Relative tolerance of the integrator.
+            atol (float): Absolute tolerance of the integrator.
+            recover (bool): If the method gives up, take the missing frames
+                from RK4 instead of raising IntegrationError. This gives
+                the same frames as IncrementalSolver with recover.
+
+        Returns:
+            list: The positions of each pendulum, as returned by
+                PendulumSolver.solve.
+        """
+        try:
+            ys = self.integrate(flame, method, rtol, atol)
+        except IntegrationError as e:
+            if not recover:
+                raise
+            ys = self.integrate(flame, 'RK4')
+            ys[:, :e.ys.shape[1]] = e.ys
+        return self.split(ys)
+
+    def split(self, ys):
+        results = []
+        for solver, start in zip(self.solvers, self.offsets):
+            n = len(solver.lenth_list)
+            results.append(solver.positions(ys[start:start + n].T))
+        return results
 
 
 if __name__ == "__main__":
@@ -84,5 +669,126 @@ if __name__ == "__main__":
 
     pendulum = PendulumSolver(lengths, weights, time_duration,
                               init_angles, init_velocities)
-    t, result = pendulum.solve()
-    print(result)
+
+    # Check the vectorized eom against the loop version
+    rng = numpy.random.default_rng(0)
+    for n in range(1, 8):
+        p = PendulumSolver(rng.uniform(5.0, 30.0, n), rng.uniform(1.0, 10.0, n),
+                           time_duration, rng.uniform(-3.14, 3.14, n),
+                           rng.uniform(-1.0, 1.0, n))
+        y = rng.uniform(-3.14, 3.14, 2 * n)
+        assert numpy.allclose(p.eom(0, y), p.eom_loop(0, y), rtol=1e-9, atol=1e-12)
+
+        # Vectorized calls and the analytic Jacobian
+        ys = rng.uniform(-3.14, 3.14, (2 * n, 3))
+        assert numpy.allclose(p.eom(0, ys).T, [p.eom(0, c) for c in ys.T])
+        h = 1e-6
+        J = numpy.array([(p.eom(0, y + h * e) - p.eom(0, y - h * e)) / (2 * h)
+                         for e in numpy.eye(2 * n)]).T
+        assert numpy.allclose(p.jac(0, y), J, rtol=1e-5, atol=1e-5)
+
+        # The linear-time equations agree with the mass matrix
+        assert numpy.allclose(p.eom_chain(0, y), p.eom(0, y), rtol=1e-9,
+                              atol=1e-12)
+        assert numpy.allclose(p.eom_chain(0, ys), p.eom(0, ys), rtol=1e-9,
+                              atol=1e-12)
+
+    # Long chains integrate with eom_chain and follow the mass matrix
+    p = PendulumSolver(rng.uniform(5.0, 30.0, 50), rng.uniform(1.0, 10.0, 50),
+                       1.0, rng.uniform(-0.3, 0.3, 50), rng.uniform(-0.1, 0.1, 50))
+    ys = p.integrate(30, rtol=1e-8, atol=1e-10)
+    assert numpy.allclose(ys, integrate(p.eom, p.time, p.initial_state(), 30,
+                                        rtol=1e-8, atol=1e-10), atol=1e-6)
+
+    # Check the batched solver against solving each pendulum alone
+    solvers = [PendulumSolver(rng.uniform(5.0, 30.0, n), rng.uniform(1.0, 10.0, n),
+                              time_duration, rng.uniform(-3.14, 3.14, n),
+                              rng.uniform(-1.0, 1.0, n)) for n in range(2, 6)]
+    batch = BatchPendulumSolver(solvers)
+    for p, result in zip(solvers, batch.solve(100, rtol=1e-10, atol=1e-10)):
+        assert numpy.allclose(result, p.solve(100, rtol=1e-10, atol=1e-10),
+                              atol=1e-4)
+
+    # A solve that gives up raises instead of returning fewer frames
+    try:
+        with numpy.errstate(over="ignore"):
+            integrate(lambda t, y: y**2, 2.0, [1.0], 20)
+    except IntegrationError as e:
+        assert 0 < e.ys.shape[1] < 20
+    else:
+        raise AssertionError("integrate returned a partial solve")
+
+    # At the game's tolerances, batching doesn't make any pendulum less
+    # accurate than solving it alone. Checked against a high-precision
+    # solution over the first 2 s, before the chaotic motion makes any two
+    # solutions drift apart.
+    stage_rng = numpy.random.default_rng(1)
+    stage = [PendulumSolver(stage_rng.uniform(5.0, 30.0, n),
+                            stage_rng.uniform(1.0, 10.0, n), 30.0,
+                            stage_rng.uniform(-3.14, 3.14, n),
+                            stage_rng.uniform(-1.0, 1.0, n))
+             for n in stage_rng.integers(2, 6, 10)]
+    references = [p.solve(600, 'DOP853', 1e-10, 1e-12)[:40] for p in stage]
+
+    def worst_error(results):
+        return max(numpy.linalg.norm(result[:40] - reference, axis=-1).max()
+                   for result, reference in zip(results, references))
+    assert worst_error(BatchPendulumSolver(stage).solve(600)) <= \
+        worst_error([p.solve(600) for p in stage])
+
+    # The fixed-step integrator works on the stacked state as well
+    for p, result in zip(solvers, batch.solve(100, method='RK4')):
+        assert numpy.allclose(result, p.solve(100, method='RK4'))
+
+    # Vectorized kinematics matches accumulating link by link
+    angles = rng.uniform(-3.14, 3.14, (10, 3))
+    expected = []
+    for angle in angles:
+        bx, by, position = 0, 0, []
+        for length, a in zip(lengths, angle):
+            bx, by = bx + length * numpy.sin(a), by - length * numpy.cos(a)
+            position.append((bx, by))
+        expected.append(position)
+    assert numpy.allclose(pendulum.positions(angles), expected)
+
+    # Incremental integration gives the same frames as solving at once
+    for method in ('RK45', 'RK4'):
+        incremental = IncrementalSolver(batch, 100, method)
+        incremental.advance_to(10)
+        assert 10 < incremental.horizon() < 100
+        incremental.advance(60.0)
+        for result, expected in zip(incremental.results,
+                                    batch.solve(100, method)):
+            assert numpy.allclose(result, expected)
+
+    # An incremental solve that gives up raises, or falls back to RK4
+    class Failing(BatchPendulumSolver):
+        # No step size gets past the NaN, so adaptive methods give up
+        def eom(self, t, y):
+            return super().eom(t, y) * (1.0 if t < 5.0 else numpy.nan)
+
+    failing = Failing(solvers)
+    try:
+        IncrementalSolver(failing, 100).advance(60.0)
+    except IntegrationError:
+        pass
+    else:
+        raise AssertionError("IncrementalSolver didn't raise")
+    incremental = IncrementalSolver(failing, 100, recover=True)
+    incremental.advance(60.0)
+    assert incremental.done()
+    for result, expected in zip(incremental.results, batch.solve(100)):
+        assert numpy.allclose(result[:40], expected[:40])
+    # Solving at once recovers with the same frames
+    for result, expected in zip(failing.solve(100, recover=True),
+                                incremental.results):
+        assert numpy.allclose(result, expected, equal_nan=True)
+
+    # Implicit methods with the analytic Jacobian agree with RK45
+    for method in ('Radau', 'auto'):
+        assert numpy.allclose(pendulum.solve(100, method, rtol=1e-8, atol=1e-8),
+                              pendulum.solve(100, rtol=1e-8, atol=1e-8),
+                              atol=1e-4)
+
+    result = pendulum.solve(100)
+    print(result[-1])
@@ -0,0 +1,183 @@
+import os
+from time import perf_counter
+
+import pyxel
+
+import lazy
+
+numpy = lazy.LazyModule("numpy", globals())
+
+PHASES = ("update", "stage", "pendulums", "collision", "afterimage",
+          "draw", "draw_scene", "draw_blit")
+
+
+class NullSection:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class Section:
+    def __init__(self, column):
+        self.column = column
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        Profiler.frame[self.column] += perf_counter() - self.start
+        return False
+
+
+class Profiler:
+    """
+    Per-phase frame timings kept in a ring buffer of the last CAPACITY
+    frames.
+
+    Wrap a phase in "with Profiler.section(name)". While disabled, section()
+    returns a shared object that does nothing, so the instrumentation can
+    stay in the game loop.
+    """
+
+    CAPACITY = 300
+    # Set THROUGHNPENDULUM_PROFILE=1 to start with the overlay shown
+    enabled = os.environ.get("THROUGHNPENDULUM_PROFILE") == "1"
+    times = None  # Allocated on the first recorded frame
+    frame = [0.0] * len(PHASES)
+    cursor = 0
+    count = 0
+
+    NULL = NullSection()
+    SECTIONS = {name: Section(i) for i, name in enumerate(PHASES)}
+
+    @classmethod
+    def section(cls, name):
+        if not cls.enabled:
+            return cls.NULL
+        return cls.SECTIONS[name]
+
+    @classmethod
+    def toggle(cls):
+        cls.enabled = not cls.enabled
+        cls.clear()
+
+    @classmethod
+    def clear(cls):
+        cls.frame = [0.0] * len(PHASES)
+        cls.cursor = 0
+        cls.count = 0
+
+    @classmethod
+    def end_frame(cls):
+        if not cls.enabled:
+            return
+        if cls.times is None:
+            cls.times = numpy.zeros((cls.CAPACITY, len(PHASES)))
+        cls.times[cls.cursor] = cls.frame
+        cls.frame = [0.0] * len(PHASES)
+        cls.cursor = (cls.cursor + 1) % cls.CAPACITY
+        cls.count = min(cls.count + 1, cls.CAPACITY)
+
+    @classmethod
+    def history(cls):
+        """
+        Returns:
+            array: Seconds spent in each phase, oldest frame first, shape
+                (frames, len(PHASES)).
+        """
+        if cls.times is None:
+            return numpy.zeros((0, len(PHASES)))
+        if cls.count < cls.CAPACITY:
+            return cls.times[:cls.count]
+        return numpy.roll(cls.times, -cls.cursor, axis=0)
+
+    @classmethod
+    def percentiles(cls, q=(50, 95, 99)):
+        """
+        Returns:
+            dict: Milliseconds at each percentile in q for every phase.
+        """
+        history = cls.history()
+        if len(history) == 0:
+            return {}
+        values = numpy.percentile(history, q, axis=0) * 1000
+        return {name: values[:, i] for i, name in enumerate(PHASES)}
+
+    @classmethod
+    def export_csv(cls, path):
+        numpy.savetxt(path, cls.history() * 1000, delimiter=",",
+                      header=",".join(f"{name}_ms" for name in PHASES),
+                      comments="", fmt="%.4f")
+
+    @classmethod
+    def draw(cls):
+        if not cls.enabled:
+            return
+        stats = cls.percentiles()
+        pyxel.rect(0, 0, 104, 6 * len(PHASES) + 8, 0)
+        pyxel.text(1, 1, "PHASE        P50   P95   P99", 10)
+        for i, name in enumerate(PHASES):
+            row = f"{name[:11]:11s}"
+            if stats:
+                row += "".join(f"{value:6.2f}" for value in stats[name])
+            pyxel.text(1, 7 + 6 * i, row, 7)
+
+
+class Startup:
+    """
+    Time from when the game started importing to each step of start-up.
+
+    With THROUGHNPENDULUM_STARTUP=1 the steps are printed once the first
+    frame is drawn and everything in `waiting` is marked.
+    """
+
+    START = perf_counter()
+    REPORT = os.environ.get("THROUGHNPENDULUM_STARTUP") == "1"
+    marks = {}  # {step: seconds}
+    waiting = {"first frame", "numerical modules"}
+    done = False
+
+    @classmethod
+    def mark(cls, step):
+        if step not in cls.marks:
+            cls.marks[step] = perf_counter() - cls.START
+        cls.waiting.discard(step)
+
+    @classmethod
+    def frame(cls):
+        if cls.done:
+            return
+        cls.mark("first frame")
+        if not cls.waiting:
+            cls.done = True
+            if cls.REPORT:
+                print(cls.report())
+
+    @classmethod
+    def report(cls):
+        lines = []
+        previous = 0.0
+        for step, seconds in sorted(cls.marks.items(), key=lambda m: m[1]):
+            lines.append(f"{step:18s} {seconds * 1000:8.1f} ms "
+                         f"(+{(seconds - previous) * 1000:.1f} ms)")
+            previous = seconds
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # Measure the cost of an instrumented section
+    import timeit
+
+    def phase():
+        with Profiler.section("update"):
+            pass
+
+    for enabled in (False, True):
+        Profiler.enabled = enabled
+        seconds = min(timeit.repeat(phase, number=100000, repeat=5)) / 100000
+        print(f"enabled={enabled}: {seconds * 1e9:.0f} ns per section")
+    Profiler.end_frame()
+    print(Profiler.percentiles())
@@ -0,0 +1,195 @@
+import array
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+import pyxel
+
+MAGIC = b"TNPR"
+VERSION = 1
+# Keys the game reads, one bit each in the per-frame input mask
+KEYS = ("KEY_W", "KEY_A", "KEY_S", "KEY_D", "KEY_UP", "KEY_DOWN", "KEY_LEFT",
+        "KEY_RIGHT", "KEY_SPACE", "KEY_RETURN")
+# Stage settings that decide what is generated and how it collides
+SETTINGS = ("SEED", "CANDIDATES", "FLAME", "SOLVER_METHOD", "FULL_COLLISION")
+
+
+class ReplayError(Exception):
+    pass
+
+
+class Recorder:
+    """
+    Records the input of every frame and the events of App to a file.
+
+    Stages have to be reproducible, so the stage RNG is seeded (with a
+    random seed unless Stage.SEED is already set) and the candidate picked
+    for each stage is recorded as an event.
+
+    Parameters:
+        path (str): Replay file, rewritten at the start of the frame after
+            each change of GameState, so it only has whole frames.
+        stage (type): main.Stage, whose settings are recorded.
+    """
+
+    def __init__(self, path, stage):
+        self.path = path
+        if stage.SEED is None:
+            stage.SEED = random.randrange(2**31)
+        self.settings = {name: getattr(stage, name) for name in SETTINGS}
+        # The compiled equations of motion round differently
+        import pendulum
+        self.settings["COMPILED"] = pendulum.COMPILED
+        self.keys = [getattr(pyxel, key) for key in KEYS]
+        self.masks = array.array("H")
+        self.events = None
+
+    def capture(self):
+        if self.events is not None:
+            write(self.path, self.settings, self.masks, self.events)
+            self.events = None
+        mask = 0
+        for bit, key in enumerate(self.keys):
+            # A press and release within one frame still counts as a press
+            if pyxel.btn(key) or pyxel.btnp(key):
+                mask |= 1 << bit
+        self.masks.append(mask)
+
+    def save(self, events):
+        self.events = events
+
+
+def write(path, settings, masks, events):
+    meta = json.dumps({"version": VERSION, "settings": settings,
+                       "events": events}).encode()
+    data = len(meta).to_bytes(4, "little") + meta + masks.tobytes()
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(MAGIC + zlib.compress(data, 9))
+    os.replace(temporary, path)
+
+
+def read(path):
+    """
+    Returns:
+        tuple: (settings, masks, events) as passed to write(), with events
+            as a list of (frame, event) tuples.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ReplayError(f"{path} is not a replay file")
+    data = zlib.decompress(data[len(MAGIC):])
+    size = int.from_bytes(data[:4], "little")
+    meta = json.loads(data[4:4 + size])
+    if meta["version"] != VERSION:
+        raise ReplayError(f"{path} has version {meta['version']}")
+    masks = array.array("H")
+    masks.frombytes(data[4 + size:])
+    return (meta["settings"], masks,
+            [tuple(event) for event in meta["events"]])
+
+
+class ReplayStages:
+    """
+    Stands in for StagePrefetcher and hands out the recorded stages.
+    """
+
+    def __init__(self, stage, events):
+        self.stage = stage
+        self.recorded = [tuple(map(int, event.split()[1:]))
+                         for _, event in events if event.startswith("STAGE ")]
+        self.chosen = 0
+
+    def start(self, level):
+        pass
+
+    def cancel(self):
+        pass
+
+    def take(self, level):
+        if not self.recorded:
+            raise ReplayError(f"level {level} was not generated in the replay")
+        recorded_level, self.chosen = self.recorded.pop(0)
+        if recorded_level != level:
+            raise ReplayError(f"level {level} generated instead of "
+                              f"{recorded_level}")
+        if self.chosen == 0:
+            # Stage.generate makes the packed stage or the first candidate
+            return None
+        solvers, apples = self.stage.random_candidates(
+            level, self.stage.CANDIDATES)[self.chosen]
+        return self.stage.build(self.stage.solve(solvers), apples)
+
+
+def replay(path):
+    """
+    Run a recording headless and compare its events.
+
+    Returns:
+        dict: "path", number of "frames", whether the events "match", the
+            "first" differing (frame, event) pairs as (recorded, replayed),
+            and the replayed "events".
+    """
+    import headless
+    import pendulum
+    import trajectory_cache
+
+    settings, masks, recorded = read(path)
+    pendulum.COMPILED = settings.pop("COMPILED", False)
+    if pendulum.COMPILED and not pendulum.compiled.ENABLED:
+        raise ReplayError(f"{path} was recorded with Numba, which is not "
+                          "enabled (THROUGHNPENDULUM_NUMBA=1)")
+    os.environ.pop("THROUGHNPENDULUM_RECORD", None)
+    runner = headless.HeadlessRunner(draw=False)
+    stub, main = runner.pyxel, runner.main
+    keys = [getattr(stub, key) for key in KEYS]
+    stub.inputs = lambda frame: [key for bit, key in enumerate(keys)
+                                 if masks[frame] >> bit & 1]
+    for name, value in settings.items():
+        setattr(main.Stage, name, value)
+    runner.app.prefetcher = ReplayStages(main.Stage, recorded)
+    runner.app.events = []
+
+    # Solve every stage from scratch, like the recording did on a cold cache
+    with tempfile.TemporaryDirectory() as directory:
+        main.Stage.CACHE = trajectory_cache.TrajectoryCache(directory)
+        runner.run(len(masks))
+    replayed = [tuple(event) for event in runner.app.events]
+    first = next(((a, b) for a, b in zip(recorded, replayed) if a != b), None)
+    if first is None and len(recorded) != len(replayed):
+        first = (recorded[len(replayed):len(replayed) + 1] or None,
+                 replayed[len(recorded):len(recorded) + 1] or None)
+    return {"path": path, "frames": len(masks), "match": first is None,
+            "first": first, "events": replayed}
+
+
+def replay_all(paths, workers=None):
+    """
+    Replay recordings in parallel, one process per recording at a time.
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                             mp_context=context) as pool:
+        return list(pool.map(replay, paths))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python replay.py replay_file...")
+        sys.exit(1)
+    if len(sys.argv) > 2:
+        results = replay_all(sys.argv[1:])
+    else:
+        results = [replay(sys.argv[1])]
+    for result in results:
+        status = "ok" if result["match"] else f"MISMATCH {result['first']}"
+        print(f"{result['path']}: {result['frames']} frames, "
+              f"{len(result['events'])} events, {status}")
+    if not all(result["match"] for result in results):
+        sys.exit(1)
@@ -0,0 +1,173 @@
+import json
+import os
+import threading
+
+import lazy
+
+numpy = lazy.LazyModule("numpy", globals())
+
+MAGIC = b"TNPS"
+VERSION = 1
+# Arrays start at multiples of ALIGN bytes so they can be memory-mapped
+ALIGN = 64
+# Screen positions fit in 16 bits, which halves the snapshot
+DTYPE = "<i2"
+
+
+class SessionError(Exception):
+    pass
+
+
+def default_path():
+    """
+    Returns:
+        str: Snapshot file, or None if THROUGHNPENDULUM_SESSION is set to
+            an empty string to disable saving.
+    """
+    path = os.environ.get(
+        "THROUGHNPENDULUM_SESSION",
+        os.path.join(os.path.expanduser("~"), ".local", "share",
+                     "throughnpendulum", "session.tnps"))
+    return path or None
+
+
+def align(offset):
+    return -(-offset // ALIGN) * ALIGN
+
+
+def write(path, meta, arrays):
+    """
+    Write a snapshot: MAGIC, VERSION and the length of the JSON meta, the
+    meta, then each array in DTYPE at the offset recorded in the meta.
+
+    Parameters:
+        path (str): Snapshot file, replaced atomically.
+        meta (dict): JSON-serializable state.
+        arrays (dict): {name: array} of integer arrays.
+    """
+    arrays = {name: numpy.ascontiguousarray(array, dtype=DTYPE)
+              for name, array in arrays.items()}
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        layout[name] = [offset, list(array.shape)]
+        offset = align(offset + array.nbytes)
+    header = json.dumps(dict(meta, arrays=layout)).encode()
+    start = align(len(MAGIC) + 8 + len(header))
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(MAGIC + VERSION.to_bytes(4, "little") +
+                len(header).to_bytes(4, "little") + header)
+        for name, array in arrays.items():
+            f.seek(start + layout[name][0])
+            f.write(array.tobytes())
+    os.replace(temporary, path)
+
+
+def read_header(path):
+    """
+    Read the meta of a snapshot without touching its arrays.
+
+    Returns:
+        dict: The meta passed to write(), with "arrays" mapping each name
+            to its [offset, shape] and "start" the offset of the arrays.
+    """
+    with open(path, "rb") as f:
+        fixed = f.read(len(MAGIC) + 8)
+        if fixed[:len(MAGIC)] != MAGIC:
+            raise SessionError(f"{path} is not a session snapshot")
+        version = int.from_bytes(fixed[len(MAGIC):len(MAGIC) + 4], "little")
+        if version != VERSION:
+            raise SessionError(f"{path} has version {version}")
+        size = int.from_bytes(fixed[len(MAGIC) + 4:], "little")
+        meta = json.loads(f.read(size))
+    meta["start"] = align(len(MAGIC) + 8 + size)
+    return meta
+
+
+def open_arrays(path, meta):
+    """
+    Returns:
+        dict: {name: read-only memmap} of the arrays of a snapshot.
+    """
+    return {name: numpy.memmap(path, dtype=DTYPE, mode="r",
+                               offset=meta["start"] + offset,
+                               shape=tuple(shape))
+            for name, (offset, shape) in meta["arrays"].items()}
+
+
+class SessionWriter:
+    """
+    Writes snapshots on a background thread, so that saving never stalls
+    the frame loop. If snapshots come faster than they are written, only
+    the latest one is written. The arrays must not be modified after
+    save().
+
+    Without threads (e.g. the web build) snapshots are written right away.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.pending = None
+        self.thread = None
+
+    def save(self, meta, arrays):
+        with self.lock:
+            self.pending = (meta, arrays)
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            try:
+                self.thread.start()
+                return
+            except RuntimeError:
+                self.thread = None
+        self.run()
+
+    def run(self):
+        while True:
+            with self.lock:
+                job, self.pending = self.pending, None
+                if job is None:
+                    self.thread = None
+                    return
+            try:
+                write(self.path, *job)
+            except OSError as e:
+                print(f"Could not save the session: {e}")
+
+    def wait(self):
+        thread = self.thread
+        if thread is not None:
+            thread.join()
+
+
+if __name__ == "__main__":
+    # A snapshot round-trips and its arrays are memory-mapped
+    import tempfile
+    from time import perf_counter
+
+    rng = numpy.random.default_rng(0)
+    arrays = {"trajectory": rng.integers(-300, 300, (600, 48, 6, 2)),
+              "boxes": rng.integers(-300, 300, (600, 48, 4))}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "session.tnps")
+        writer = SessionWriter(path)
+        start = perf_counter()
+        writer.save({"level": 3}, {})
+        writer.save({"level": 7}, arrays)
+        print(f"save() returned after {(perf_counter() - start) * 1e3:.2f} ms")
+        writer.wait()
+
+        start = perf_counter()
+        meta = read_header(path)
+        loaded = open_arrays(path, meta)
+        print(f"resumed in {(perf_counter() - start) * 1e3:.2f} ms, "
+              f"{os.path.getsize(path) / 1024:.0f} KiB")
+        assert meta["level"] == 7
+        for name, array in arrays.items():
+            assert isinstance(loaded[name], numpy.memmap)
+            assert (loaded[name] == array).all()
+        del loaded
@@ -0,0 +1,145 @@
+import multiprocessing
+import os
+import threading
+from time import perf_counter
+
+import numpy
+
+import pendulum
+
+# Seconds between checks for finished candidates and cancellation
+POLL = 0.01
+
+
+def pool():
+    """
+    Process pool for one call to choose(). It is terminated when choose()
+    returns, so that candidates that are still being solved stop taking
+    the CPU from the game and from the next call.
+
+    Returns:
+        multiprocessing.pool.Pool: The pool, or None where processes can't
+            be started (e.g. the web build).
+    """
+    try:
+        return multiprocessing.get_context("spawn").Pool(
+            max(1, (os.cpu_count() or 1) - 1))
+    except (ImportError, NotImplementedError, OSError, ValueError):
+        return None
+
+
+def score(results, centers, apples, geometry):
+    """
+    Measure how dangerous a stage is from its trajectories.
+
+    Parameters:
+        results (list): Positions of each pendulum relative to its center,
+            as returned by PendulumSolver.solve.
+        centers (list): Screen position of the center of each pendulum.
+        apples (list): Screen position (x, y) of each apple.
+        geometry (dict): Sizes of the stage, see main.Stage.GEOMETRY.
+
+    Returns:
+        dict: Fractions of frames in which the pendulums sweep the floor
+            where the character walks ("floor"), the start point ("start")
+            and the surroundings of the apples on average ("apples"), and
+            the combined "difficulty".
+    """
+    joints = numpy.concatenate([
+        numpy.asarray(result) * (1, -1) + center
+        for result, center in zip(results, centers)], axis=1)
+    x, y = joints[..., 0], joints[..., 1]
+    reach = geometry["radius"] + geometry["character"] // 2
+
+    floor = geometry["floor"]
+    on_floor = (y > floor - geometry["character"] - geometry["radius"]) & \
+        (y < floor + geometry["radius"])
+    sx, sy = geometry["start"]
+    near_start = (x - sx)**2 + (y - sy)**2 < (reach + geometry["start_r"])**2
+    near_apples = [
+        ((x - ax)**2 + (y - ay)**2 < (reach + geometry["apple_r"])**2).any(axis=1)
+        for ax, ay in apples]
+
+    s = {
+        "floor": float(on_floor.any(axis=1).mean()),
+        "start": float(near_start.any(axis=1).mean()),
+        "apples": float(numpy.mean(near_apples)) if apples else 0.0,
+    }
+    s["difficulty"] = (s["floor"] + s["apples"]) / 2
+    return s
+
+
+def solve_and_score(solvers, centers, apples, flame, method, geometry):
+    start = perf_counter()
+    results = pendulum.BatchPendulumSolver(solvers).solve(
+        flame, method, recover=True)
+    seconds = perf_counter() - start
+    s = score(results, centers, apples, geometry)
+    # Time of the solve, for the statistics of the trajectory cache
+    s["seconds"] = seconds
+    return results, s
+
+
+def cost(s, target):
+    # Sweeping the start point is unfair at any difficulty
+    return abs(s["difficulty"] - target) + s["start"]
+
+
+def choose(jobs, target, budget, cancelled=None):
+    """
+    Solve candidate stages in parallel and pick the best one.
+
+    Parameters:
+        jobs (list): Arguments of solve_and_score for each candidate.
+        target (float): Wanted difficulty.
+        budget (float): Seconds to wait for candidates. At least one
+            candidate is always finished, unless every one fails to solve.
+        cancelled (threading.Event): Once set, no more candidates are
+            solved and the ones being solved are stopped.
+
+    Returns:
+        tuple: (index, results, score) of the candidate whose difficulty
+            is closest to the target, or None if cancelled.
+
+    Raises:
+        pendulum.IntegrationError: If no candidate could be solved.
+    """
+    start = perf_counter()
+    cancelled = cancelled or threading.Event()
+    if cancelled.is_set():
+        return None
+    finished = []
+    workers = pool()
+    if workers is None:
+        for i, job in enumerate(jobs):
+            if cancelled.is_set():
+                return None
+            try:
+                finished.append((i, *solve_and_score(*job)))
+            except pendulum.IntegrationError:
+                continue
+            if perf_counter() - start > budget:
+                break
+    else:
+        try:
+            pending = {workers.apply_async(solve_and_score, job): i
+                       for i, job in enumerate(jobs)}
+            while pending:
+                if cancelled.wait(POLL):
+                    return None
+                for result in [r for r in pending if r.ready()]:
+                    i = pending.pop(result)
+                    try:
+                        finished.append((i, *result.get()))
+                    except pendulum.IntegrationError:
+                        # Candidates the integrator gave up on are left out
+                        continue
+                if finished and perf_counter() - start > budget:
+                    break
+        finally:
+            workers.terminate()
+            workers.join()
+
+    if not finished:
+        raise pendulum.IntegrationError("no candidate could be solved", None)
+    return min(finished, key=lambda candidate: cost(candidate[2], target))
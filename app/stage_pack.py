@@ -0,0 +1,80 @@
+import os
+
+import lazy
+
+numpy = lazy.LazyModule("numpy", globals())
+
+VERSION = 1
+# Positions are stored as fixed-point numbers in units of 1/SCALE pixels,
+# as differences from the previous frame so that they compress well
+SCALE = 16
+
+
+def default_path():
+    return os.path.join(os.path.dirname(__file__), "assets", "stages.npz")
+
+
+def save(path, stages, flame):
+    """
+    Write a stage pack.
+
+    Parameters:
+        path (str): Output .npz file.
+        stages (dict): {level: (results, apples)} where results are the
+            positions of each pendulum as returned by PendulumSolver.solve
+            and apples is a list of (x, y).
+        flame (int): Number of frames of every trajectory.
+    """
+    arrays = {"meta": numpy.array([VERSION, flame])}
+    for level, (results, apples) in stages.items():
+        arrays[f"level{level}_apples"] = numpy.array(apples, dtype=numpy.int16)
+        for i, result in enumerate(results):
+            fixed = numpy.round(numpy.asarray(result) * SCALE).astype(int)
+            arrays[f"level{level}_pendulum{i}"] = numpy.diff(
+                fixed, axis=0, prepend=0).astype(numpy.int16)
+    numpy.savez_compressed(path, **arrays)
+
+
+class StagePack:
+    """
+    Precomputed stages read from a file written by save().
+
+    The file is opened on first use and each level is decompressed only
+    when it is loaded.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or default_path()
+        self.data = None
+
+    def open(self):
+        if self.data is None:
+            try:
+                self.data = numpy.load(self.path)
+            except (OSError, ValueError):
+                self.data = {}
+        return self.data
+
+    def contains(self, level, flame):
+        data = self.open()
+        if "meta" not in data:
+            return False
+        version, pack_flame = data["meta"]
+        return (version == VERSION and pack_flame == flame and
+                f"level{level}_apples" in data)
+
+    def load(self, level, flame):
+        """
+        Returns:
+            tuple: (results, apples) of the level as passed to save(), or
+                None if the pack doesn't have it.
+        """
+        if not self.contains(level, flame):
+            return None
+        data = self.open()
+        results = []
+        while f"level{level}_pendulum{len(results)}" in data:
+            key = f"level{level}_pendulum{len(results)}"
+            results.append(numpy.cumsum(data[key], axis=0) / SCALE)
+        apples = [tuple(apple) for apple in data[f"level{level}_apples"].tolist()]
+        return results, apples
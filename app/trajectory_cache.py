@@ -0,0 +1,177 @@
+import hashlib
+import os
+import threading
+from time import perf_counter
+
+import lazy
+
+numpy = lazy.LazyModule("numpy", globals())
+pendulum = lazy.LazyModule("pendulum", globals())
+
+# Part of every key. Bumped when the solvers give different trajectories
+# for the same inputs, so that stale files are never read back.
+VERSION = 2
+
+
+def default_directory():
+    return os.environ.get(
+        "THROUGHNPENDULUM_CACHE",
+        os.path.join(os.path.expanduser("~"), ".cache", "throughnpendulum"))
+
+
+class TrajectoryCache:
+    """
+    On-disk cache of solved trajectories.
+
+    Each trajectory is stored as a .npy file named after a hash of
+    everything that determines it, and is memory-mapped when read back.
+    The least recently used files are removed when the cache grows beyond
+    `max_bytes`.
+    """
+
+    def __init__(self, directory=None, max_bytes=64 * 1024 * 1024):
+        self.directory = directory or default_directory()
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.index = None  # {key: [size, last_used]}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.hit_seconds = 0.0
+        self.miss_seconds = 0.0
+
+    @staticmethod
+    def key(solvers, index, flame, method, rtol=1e-3, atol=1e-6):
+        """
+        Hash of the inputs of BatchPendulumSolver.solve, for one of the
+        pendulums of the batch.
+
+        Adaptive integrators control the step of the whole batch together,
+        so a trajectory depends on every pendulum it was solved with, and
+        the key covers all of them in order.
+
+        Parameters:
+            solvers (list): PendulumSolvers solved together.
+            index (int): Index of the pendulum in solvers.
+            flame (int): Number of time points to evaluate.
+            method (str): Integrator.
+            rtol (float): Relative tolerance of the integrator.
+            atol (float): Absolute tolerance of the integrator.
+
+        Returns:
+            str: Hex digest identifying the trajectory.
+        """
+        h = hashlib.sha256()
+        h.update(repr((VERSION, method, flame, rtol, atol,
+                       pendulum.RK4_SUBSTEPS, pendulum.COMPILED, index,
+                       len(solvers))).encode())
+        for solver in solvers:
+            h.update(repr(float(solver.time)).encode())
+            for values in (solver.lenth_list, solver.weight_list,
+                           solver.init_angles, solver.init_velocities):
+                h.update(numpy.asarray(values, dtype=numpy.float64).tobytes())
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npy")
+
+    def load_index(self):
+        if self.index is not None:
+            return True
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            entries = [entry for entry in os.scandir(self.directory)
+                       if entry.name.endswith(".npy")]
+        except OSError:
+            return False
+        self.index = {}
+        for entry in entries:
+            stat = entry.stat()
+            self.index[entry.name[:-4]] = [stat.st_size, stat.st_mtime]
+        return True
+
+    def get(self, key):
+        """
+        Returns:
+            numpy.memmap: The cached positions, or None on a miss.
+        """
+        start = perf_counter()
+        with self.lock:
+            if not self.load_index() or key not in self.index:
+                self.misses += 1
+                return None
+        path = self.path(key)
+        try:
+            result = numpy.load(path, mmap_mode="r")
+            os.utime(path)
+            with self.lock:
+                # put() on another thread may have evicted it meanwhile
+                if key in self.index:
+                    self.index[key][1] = os.path.getmtime(path)
+                self.hits += 1
+                self.hit_seconds += perf_counter() - start
+        except (OSError, ValueError):
+            with self.lock:
+                self.index.pop(key, None)
+                self.misses += 1
+            return None
+        return result
+
+    def put(self, key, positions, seconds=0.0):
+        """
+        Store solved positions.
+
+        Parameters:
+            key (str): Key from TrajectoryCache.key.
+            positions (list): Positions as returned by PendulumSolver.solve.
+            seconds (float): Time it took to solve, for the statistics.
+        """
+        with self.lock:
+            self.miss_seconds += seconds
+            if not self.load_index():
+                return
+        path = self.path(key)
+        temp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp, "wb") as f:
+                numpy.save(f, numpy.asarray(positions, dtype=numpy.float64))
+            os.replace(temp, path)
+        except OSError:
+            return
+        with self.lock:
+            self.index[key] = [os.path.getsize(path), os.path.getmtime(path)]
+            self.evict()
+
+    def evict(self):
+        total = sum(size for size, _ in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k][1]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                continue
+            total -= self.index.pop(key)[0]
+            self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "bytes": sum(size for size, _ in (self.index or {}).values()),
+                "hit_seconds": self.hit_seconds,
+                "miss_seconds": self.miss_seconds,
+            }
+
+    def summary(self):
+        s = self.stats()
+        hit = s["hit_seconds"] / s["hits"] if s["hits"] else 0.0
+        miss = s["miss_seconds"] / s["misses"] if s["misses"] else 0.0
+        return (f"trajectory cache: {s['hits']} hits, {s['misses']} misses "
+                f"({s['hit_rate']:.0%}), {s['evictions']} evictions, "
+                f"{s['bytes'] / 1024:.0f} KiB, "
+                f"{hit * 1000:.1f} ms per hit, {miss * 1000:.1f} ms per miss")
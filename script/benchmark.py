@@ -0,0 +1,185 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+import numpy
+import pyxel
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+import main  # noqa: E402
+import pendulum  # noqa: E402
+import stage_pack  # noqa: E402
+import trajectory_cache  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__),
+                                "benchmark_baseline.json")
+
+EOM_LINKS = (2, 3, 4, 5, 10, 20, 50, 100, 200, 500)
+SOLVE_LINKS = (2, 3, 4, 5, 10, 20, 50)
+SOLVE_METHODS = ("RK45", "RK4", "auto")
+FLAMES = (150, 300, main.Stage.FLAME, 1200)
+DURATIONS = (5, 10, main.Pendulum.TIME_DURATION)
+# One level of each number of pendulums, and one endless level
+STAGE_LEVELS = (1, 10, 20, 30, 40, 60)
+# Pendulums on screen, up to the most an endless level has
+FRAME_PENDULUMS = (5, 10, 20, 40, main.Stage.MAX_N_ENDLESS)
+
+
+def random_solver(rng, n, time=main.Pendulum.TIME_DURATION):
+    return pendulum.PendulumSolver(
+        rng.uniform(*main.Pendulum.LENGTH_RANGE, n),
+        rng.uniform(*main.Pendulum.WEIGHT_RANGE, n),
+        time,
+        rng.uniform(*main.Pendulum.INIT_ANGLE_RANGE, n),
+        rng.uniform(*main.Pendulum.INIT_VELOCITY_RANGE, n))
+
+
+def random_stage(rng, count):
+    # Frame costs don't depend on the physics, so random walks of the
+    # angles stand in for solved trajectories
+    scale = min(1.0, (main.Stage.MAX_N_PENDULUM / count) ** 0.5)
+    results = []
+    for _ in range(count):
+        n = int(rng.integers(*main.Stage.PENDULUM_RANGE, endpoint=True))
+        angles = numpy.cumsum(
+            rng.uniform(-0.1, 0.1, (main.Stage.FLAME, n)), axis=0)
+        results.append(pendulum.forward_kinematics(
+            rng.uniform(*main.Pendulum.LENGTH_RANGE, n) * scale, angles))
+    pendulums, _ = main.Stage.build(results, [])
+    return pendulums
+
+
+def measure(fun, repeat, number=1):
+    # Best of several runs, in seconds per call
+    return min(timeit.repeat(fun, repeat=repeat, number=number)) / number
+
+
+def benchmarks(quick):
+    rng = numpy.random.default_rng(0)
+    repeat = 1 if quick else 3
+    eom_links = EOM_LINKS[:5] if quick else EOM_LINKS
+    solve_links = SOLVE_LINKS[:4] if quick else SOLVE_LINKS
+    flames = () if quick else FLAMES
+    durations = () if quick else DURATIONS
+    frame_pendulums = FRAME_PENDULUMS[::4] if quick else FRAME_PENDULUMS
+
+    for n in eom_links:
+        solver = random_solver(rng, n)
+        y = solver.initial_state()
+        # Fewer calls on long chains, where the matrix solve takes ms
+        number = 200 if n <= 100 else 20
+        yield f"eom/n={n}", measure(lambda: solver.eom(0, y), repeat, number)
+        yield f"eom_chain/n={n}", measure(
+            lambda: solver.eom_chain(0, y), repeat, number)
+        if pendulum.COMPILED:
+            yield f"eom_compiled/n={n}", measure(
+                lambda: solver.eom_compiled(0, y), repeat, number)
+        if n <= 5:
+            yield f"eom_loop/n={n}", measure(
+                lambda: solver.eom_loop(0, y), repeat, 200)
+
+    for method in SOLVE_METHODS:
+        for n in solve_links:
+            solver = random_solver(rng, n)
+            # Fixed steps can diverge on long chains, only the time matters
+            with numpy.errstate(over="ignore", invalid="ignore"):
+                seconds = measure(
+                    lambda: solver.solve(main.Stage.FLAME, method), repeat)
+            yield f"solve/{method}/n={n}", seconds
+
+    solver = random_solver(rng, 3)
+    for flame in flames:
+        yield (f"solve/RK45/n=3/flame={flame}",
+               measure(lambda: solver.solve(flame), repeat))
+    for duration in durations:
+        solver = random_solver(rng, 3, duration)
+        yield (f"solve/RK45/n=3/time={duration}",
+               measure(lambda: solver.solve(main.Stage.FLAME), repeat))
+
+    # Update, collision and drawing of one frame as pendulums are added,
+    # with the character among the pivots where most boxes overlap it
+    os.environ.setdefault("SDL_VIDEODRIVER", "offscreen")
+    pyxel.init(main.WINDOW_W, main.WINDOW_H)
+    character = main.Character()
+    character.x, character.y = main.WINDOW_W // 2, main.FLOOR // 3
+    frames = range(1, main.Stage.FLAME)
+    for count in frame_pendulums:
+        pendulums = random_stage(rng, count)
+
+        def update():
+            for i in frames:
+                pendulums.update(i)
+                main.AfterImage.update()
+                character.collision_to_linkages(pendulums)
+        yield (f"frame/update/pendulums={count}",
+               measure(update, repeat) / len(frames))
+        yield (f"frame/draw/pendulums={count}", measure(
+            lambda: main.Playfield.draw(pendulums, 1, main.WINDOW_H // 2),
+            repeat, 100))
+        main.AfterImage.clear()
+
+    # Full stage generation without the stage pack or a warm cache, seeded
+    # so that every run solves the same stages
+    main.Stage.SEED = 0
+    main.Stage.PACK = stage_pack.StagePack()
+    main.Stage.PACK.data = {}
+    for level in STAGE_LEVELS:
+        def generate():
+            with tempfile.TemporaryDirectory() as directory:
+                main.Stage.CACHE = trajectory_cache.TrajectoryCache(directory)
+                main.Stage.generate(level)
+        yield f"stage/level={level}", measure(generate, repeat)
+
+
+def compare(results, baseline, margin):
+    """
+    Returns:
+        list: Messages about benchmarks slower than baseline * (1 + margin).
+    """
+    regressions = []
+    for name, seconds in results.items():
+        if name not in baseline:
+            continue
+        if seconds > baseline[name] * (1 + margin):
+            regressions.append(
+                f"{name}: {seconds * 1000:.3f} ms, baseline "
+                f"{baseline[name] * 1000:.3f} ms "
+                f"({seconds / baseline[name] - 1:+.0%})")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark PendulumSolver and stage generation.")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE,
+                        help="JSON results to compare against")
+    parser.add_argument("--margin", type=float, default=0.2,
+                        help="allowed slowdown against the baseline")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store the results as the new baseline")
+    parser.add_argument("--quick", action="store_true",
+                        help="small configurations only, one run each")
+    args = parser.parse_args()
+
+    results = {}
+    for name, seconds in benchmarks(args.quick):
+        results[name] = seconds
+        print(f"{name:32s} {seconds * 1000:10.3f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.margin)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            sys.exit(1)
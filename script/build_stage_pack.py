@@ -0,0 +1,48 @@
+import os
+import sys
+import time
+
+APP_DIR = os.path.join(os.path.dirname(__file__), "..", "app")
+sys.path.insert(0, APP_DIR)
+import main  # noqa: E402
+import pendulum  # noqa: E402
+import stage_pack  # noqa: E402
+
+# Candidates scored per level for the shipped app/assets/stages.npz
+CANDIDATES = 32
+
+
+def build(seed, last_level, path, candidates=CANDIDATES):
+    main.Stage.SEED = seed
+    # Score every candidate, so that the pack doesn't depend on how many
+    # finish within the budget on this machine
+    main.Stage.CANDIDATE_BUDGET = 3600.0
+    stages = {}
+    for level in range(1, last_level + 1):
+        start = time.perf_counter()
+        if candidates > 1:
+            _, results, apples = main.Stage.choose(
+                level, main.Stage.random_candidates(level, candidates))
+        else:
+            solvers, apples = main.Stage.random_parameters(level)
+            results = pendulum.BatchPendulumSolver(solvers).solve(
+                main.Stage.FLAME, main.Stage.SOLVER_METHOD, recover=True)
+        stages[level] = (results, [(apple.x, apple.y) for apple in apples])
+        print(f"level {level}: {len(results)} pendulums, "
+              f"{time.perf_counter() - start:.2f} s")
+    stage_pack.save(path, stages, main.Stage.FLAME)
+    print(f"wrote {path} ({os.path.getsize(path) / 1024:.0f} KiB)")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 4:
+        print("Usage: python build_stage_pack.py [seed] [output] [candidates]")
+        sys.exit(1)
+    try:
+        seed = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+        candidates = int(sys.argv[3]) if len(sys.argv) > 3 else CANDIDATES
+    except ValueError:
+        print("Invalid input. Please provide integers for seed and candidates.")
+        sys.exit(1)
+    path = sys.argv[2] if len(sys.argv) > 2 else stage_pack.default_path()
+    build(seed, main.Stage.GAME_CLEAR_STAGE, path, candidates)
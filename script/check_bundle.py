@@ -0,0 +1,49 @@
+import glob
+import os
+import sys
+import zipfile
+
+ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def mismatches(bundle):
+    """
+    Compare the sources and assets packaged in bundle with app/.
+
+    Returns:
+        list: Messages about files missing from the bundle, left over in it
+            or different from the working tree.
+    """
+    with zipfile.ZipFile(bundle) as archive:
+        packaged = {name: archive.read(name) for name in archive.namelist()
+                    if name.endswith(".py") or name.startswith("app/assets/")}
+    files = glob.glob(os.path.join(ROOT, "app", "*.py")) + \
+        glob.glob(os.path.join(ROOT, "app", "assets", "*"))
+
+    messages = []
+    for path in sorted(files):
+        name = os.path.relpath(path, ROOT).replace(os.sep, "/")
+        with open(path, "rb") as f:
+            data = f.read()
+        if name not in packaged:
+            messages.append(f"{name}: missing from {bundle}")
+        elif packaged.pop(name) != data:
+            messages.append(f"{name}: differs from {bundle}")
+    for name in sorted(packaged):
+        messages.append(f"{name}: in {bundle} but not in app/")
+    return messages
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        print("Usage: python check_bundle.py [bundle]")
+        sys.exit(1)
+    bundle = sys.argv[1] if len(sys.argv) > 1 else \
+        os.path.join(ROOT, "app.pyxapp")
+    messages = mismatches(bundle)
+    for message in messages:
+        print(message)
+    if messages:
+        print("Rebuild it with: pyxel package app app/main.py")
+        sys.exit(1)
+    print(f"{bundle} matches app/")
@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+import pendulum  # noqa: E402
+
+# Same ranges as main.Pendulum and main.Stage
+LENGTH_RANGE = (5.0, 30.0)
+WEIGHT_RANGE = (1.0, 10.0)
+INIT_ANGLE_RANGE = (-3.14, 3.14)
+INIT_VELOCITY_RANGE = (-1.0, 1.0)
+TIME_DURATION = 30
+FLAME = 600
+
+METHODS = ("RK45", "RK4", "Radau", "auto")
+
+
+def random_solvers(count, seed):
+    rng = numpy.random.default_rng(seed)
+    solvers = []
+    for _ in range(count):
+        n = rng.integers(2, 6)
+        solvers.append(pendulum.PendulumSolver(
+            rng.uniform(*LENGTH_RANGE, n),
+            rng.uniform(*WEIGHT_RANGE, n),
+            TIME_DURATION,
+            rng.uniform(*INIT_ANGLE_RANGE, n),
+            rng.uniform(*INIT_VELOCITY_RANGE, n)))
+    return solvers
+
+
+def tip_error(solver, ys, reference, frames):
+    n = len(solver.lenth_list)
+    tip = numpy.array(solver.positions(ys[:n, :frames].T))[:, -1]
+    ref = numpy.array(solver.positions(reference[:n, :frames].T))[:, -1]
+    return numpy.max(numpy.hypot(*(tip - ref).T))
+
+
+def report(count, seed):
+    solvers = random_solvers(count, seed)
+    references = [s.integrate(FLAME, "DOP853", rtol=1e-10, atol=1e-10)
+                  for s in solvers]
+    # Frames before chaotic divergence makes any comparison meaningless
+    short = FLAME // 10
+
+    print(f"{count} pendulums, {FLAME} frames over {TIME_DURATION} s")
+    print("method  time[s]  tip error 3s[px]  tip error 30s[px]  energy drift")
+    for method in METHODS:
+        elapsed, short_errors, errors, drifts = 0.0, [], [], []
+        for solver, reference in zip(solvers, references):
+            start = time.perf_counter()
+            ys = solver.integrate(FLAME, method)
+            elapsed += time.perf_counter() - start
+            short_errors.append(tip_error(solver, ys, reference, short))
+            errors.append(tip_error(solver, ys, reference, FLAME))
+            energy = solver.energy(ys)
+            scale = numpy.abs(solver.energy(reference)).max()
+            drifts.append(numpy.abs(energy - energy[0]).max() / scale)
+        print(f"{method:6s}  {elapsed:7.3f}  {numpy.median(short_errors):16.4f}"
+              f"  {numpy.median(errors):17.2f}  {numpy.median(drifts):12.2e}")
+
+    batch = pendulum.BatchPendulumSolver(solvers)
+    for method in METHODS:
+        start = time.perf_counter()
+        batch.integrate(FLAME, method)
+        print(f"batched {method}: {time.perf_counter() - start:.3f} s")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 3:
+        print("Usage: python integrator_report.py [count] [seed]")
+        sys.exit(1)
+    try:
+        count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+        seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    except ValueError:
+        print("Invalid input. Please provide integers for count and seed.")
+        sys.exit(1)
+    report(count, seed)
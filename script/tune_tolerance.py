@@ -0,0 +1,44 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+import accuracy  # noqa: E402
+import pendulum  # noqa: E402
+from integrator_report import FLAME, TIME_DURATION, random_solvers  # noqa: E402
+
+METHODS = ("RK45", "RK4")
+PENDULUMS_PER_STAGE = 5
+
+
+def report(max_error, count, seed, seconds=None):
+    # By default up to where two high-precision solutions drift apart
+    horizon = None if seconds is None else int(seconds * FLAME / TIME_DURATION)
+    print(f"max error {max_error} px, {count} stages of "
+          f"{PENDULUMS_PER_STAGE} pendulums, {FLAME} frames")
+    print("method  setting  met  error[px]  horizon  time[s]  speedup")
+    for method in METHODS:
+        for stage in range(count):
+            batch = pendulum.BatchPendulumSolver(
+                random_solvers(PENDULUMS_PER_STAGE, seed + stage))
+            _, r = accuracy.tune(batch, FLAME, max_error, method, horizon)
+            setting = r.get("substeps", r.get("rtol"))
+            print(f"{method:6s}  {setting:7g}  {'yes' if r['met'] else 'no':3s}"
+                  f"  {r['error']:9.3f}  {r['horizon']:7d}  "
+                  f"{r['seconds']:7.3f}  {r['speedup']:7.2f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 5:
+        print("Usage: python tune_tolerance.py [max_error] [count] [seed] "
+              "[horizon_seconds]")
+        sys.exit(1)
+    try:
+        max_error = float(sys.argv[1]) if len(sys.argv) > 1 else 0.5
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+        seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+        seconds = float(sys.argv[4]) if len(sys.argv) > 4 else None
+    except ValueError:
+        print("Invalid input. Please provide numbers for max_error and "
+              "horizon_seconds and integers for count and seed.")
+        sys.exit(1)
+    report(max_error, count, seed, seconds)